@@ -0,0 +1,264 @@
+# anomaly.py - mapy różnic zdjęć NOK względem wzorca ze zdjęć OK i ocena anomalii (NumPy)
+import hashlib
+import heapq
+import io
+import logging
+import os
+import threading
+import time
+import weakref
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+import numpy as np
+from PIL import Image
+from PIL.PngImagePlugin import PngInfo
+
+from thumbs import DiskLRUCache
+
+log = logging.getLogger(__name__)
+
+WORK_WIDTH = 512  # szerokość, w której porównywane są zdjęcia
+BLOCK = 8  # różnice uśredniane w blokach BLOCK x BLOCK px (tłumi szum matrycy)
+SCORE_PERCENTILE = 99
+HEAT_FULL_SCALE = 48.0  # średnia różnica jasności bloku (0-255) dająca pełną czerwień
+HEAT_MIN = 0.15  # słabsze różnice są w nakładce przezroczyste
+
+_x = np.linspace(0.0, 1.0, 256)
+# Paleta nakładki: niebieski -> żółty -> czerwony
+HEAT_LUT = np.stack([np.interp(_x, [0.0, 0.5, 1.0], channel)
+                     for channel in ([0, 255, 255], [128, 255, 0], [255, 0, 0])], axis=1).astype(np.uint8)
+
+
+def work_size(width, height, work_width=WORK_WIDTH, block=BLOCK):
+    """Rozmiar porównania (szer., wys.) o proporcjach zdjęcia, podzielny przez `block`."""
+    w = work_width // block * block
+    h = max(round(w * height / max(width, 1) / block), 1) * block
+    return w, h
+
+
+def load_frame(src, size):
+    """Luminancja zdjęcia jako tablica uint8 (H, W) w rozmiarze porównania.
+
+    JPEG jest dekodowany od razu w skali 1/2-1/8 i w odcieniach szarości
+    (Image.draft), bez składowych koloru, których porównanie nie używa.
+    """
+    with Image.open(src) as img:
+        img.draft("L", size)
+        img = img.convert("L")
+        if img.size != size:
+            img = img.resize(size, Image.Resampling.BILINEAR)
+    return np.asarray(img)
+
+
+def build_golden(frames):
+    """Wzorzec (H, W): mediana piksel po pikselu z partii zdjęć OK (N, H, W)."""
+    return np.median(frames, axis=0).astype(np.float32)
+
+
+def diff_maps(golden, frames, block=BLOCK):
+    """Mapy różnic (B, H/block, W/block) i oceny anomalii (B,) dla partii zdjęć (B, H, W) uint8.
+
+    Średnia jasność każdej klatki jest najpierw wyrównywana do wzorca (zmiana
+    oświetlenia to nie wada). Ocena to 99. percentyl mapy bloków w skali 0-1.
+    Całość liczona na jednej tablicy float32 partii, bez tablic pośrednich.
+    """
+    diff = frames.astype(np.float32)
+    diff += (golden.mean() - diff.mean(axis=(1, 2), keepdims=True, dtype=np.float64)).astype(np.float32)
+    diff -= golden
+    np.abs(diff, out=diff)
+    b, h, w = diff.shape
+    maps = diff.reshape(b, h // block, block, w // block, block).sum(axis=(2, 4))
+    maps *= 1.0 / (block * block)
+    scores = np.percentile(maps.reshape(b, -1), SCORE_PERCENTILE, axis=1) / 255.0
+    return maps, scores
+
+
+def render_overlay(diff_map, size, score, golden_frames):
+    """Półprzezroczysta nakładka PNG (RGBA) w rozmiarze `size`; ocena zapisana w metadanych."""
+    level = np.clip(diff_map / HEAT_FULL_SCALE, 0.0, 1.0)
+    rgba = np.empty(level.shape + (4,), dtype=np.uint8)
+    rgba[..., :3] = HEAT_LUT[(level * 255).astype(np.uint8)]
+    rgba[..., 3] = np.where(level < HEAT_MIN, 0, 64 + 160 * level).astype(np.uint8)
+    img = Image.fromarray(rgba).resize(size, Image.Resampling.BILINEAR)
+    info = PngInfo()
+    info.add_text("anomaly_score", f"{score:.4f}")
+    info.add_text("golden_frames", str(golden_frames))
+    out = io.BytesIO()
+    img.save(out, "PNG", pnginfo=info)
+    return out.getvalue()
+
+
+def read_score(path):
+    with Image.open(path) as img:
+        return float(img.text["anomaly_score"])
+
+
+class Golden(NamedTuple):
+    ident: tuple  # (kategoria, nazwa, mtime) zdjęć, z których zbudowano wzorzec
+    size: tuple  # rozmiar porównania (szer., wys.)
+    image: np.ndarray  # (H, W) float32
+    built: float  # time.monotonic() zbudowania
+
+
+class AnomalyDetector:
+    """Nakładki z mapą różnic i oceny anomalii zdjęć NOK, trzymane w DiskLRUCache.
+
+    Wzorzec kamery to mediana `golden_frames` najnowszych zdjęć OK; przy ciągłym
+    napływie zdjęć OK jest przebudowywany najwyżej co `golden_max_age` s. Po
+    start() wątek w tle liczy wyniki nowych zdjęć NOK partiami po `batch`
+    (dekodowanie w puli wątków, jedno porównanie NumPy na partię); wynik
+    brakujący w cache jest liczony także przy żądaniu.
+    """
+
+    def __init__(self, directory, max_bytes, batch=16, golden_frames=8, golden_max_age=300.0,
+                 keep_recent=10, max_pending=256, decode_threads=4):
+        self.cache = DiskLRUCache(directory, max_bytes)
+        self.batch = batch
+        self.golden_frames = golden_frames
+        self.golden_max_age = golden_max_age
+        self.keep_recent = keep_recent
+        self.max_pending = max_pending
+        self._decoder = ThreadPoolExecutor(decode_threads, thread_name_prefix="anomaly-decode")
+        self._golden_lock = threading.Lock()
+        self._goldens = weakref.WeakKeyDictionary()  # CameraIndex -> Golden
+        self._pending = deque()  # (CameraIndex, ścieżka zdjęcia)
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def key(self, src, st):
+        ident = f"{src}|{st.st_mtime_ns}|{st.st_size}".encode()
+        return hashlib.sha1(ident).hexdigest() + ".png"
+
+    # --- wzorzec ---
+
+    def golden(self, index):
+        """Aktualny wzorzec kamery albo None, gdy nie ma jeszcze zdjęć OK."""
+        records = index.recent_good(self.golden_frames)
+        ident = tuple((r.category, r.name, r.mtime) for r in records)
+        with self._golden_lock:
+            golden = self._goldens.get(index)
+            if golden is not None and (golden.ident == ident or not records
+                                       or time.monotonic() - golden.built < self.golden_max_age):
+                return golden
+            if not records:
+                return None
+            paths = [os.path.join(str(index.base_dir), r.category, r.name) for r in records]
+            try:
+                with Image.open(paths[0]) as img:
+                    size = work_size(*img.size)
+            except (OSError, Image.DecompressionBombError):
+                return golden
+            frames = [f for f in self._decode(paths, size) if f is not None]
+            if not frames:
+                return golden
+            golden = Golden(ident, size, build_golden(np.stack(frames)), time.monotonic())
+            self._goldens[index] = golden
+            return golden
+
+    # --- obliczenia ---
+
+    def _load(self, src, size):
+        try:
+            return load_frame(src, size)
+        except FileNotFoundError:
+            return None
+        except (OSError, Image.DecompressionBombError):
+            log.exception("Nie można odczytać zdjęcia %s", src)
+            return None
+
+    def _decode(self, paths, size):
+        return list(self._decoder.map(lambda src: self._load(src, size), paths))
+
+    def process(self, index, paths):
+        """Liczy i zapisuje wyniki dla partii zdjęć kamery; zwraca [(ścieżka PNG, ocena) | None]."""
+        results = [None] * len(paths)
+        golden = self.golden(index)
+        if golden is None:
+            return results
+        stats = []
+        for src in paths:
+            try:
+                stats.append(os.stat(src))
+            except FileNotFoundError:
+                stats.append(None)
+        frames = self._decode(paths, golden.size)
+        ok = [i for i, frame in enumerate(frames) if frame is not None and stats[i] is not None]
+        if not ok:
+            return results
+        maps, scores = diff_maps(golden.image, np.stack([frames[i] for i in ok]))
+        for j, i in enumerate(ok):
+            data = render_overlay(maps[j], golden.size, scores[j], len(golden.ident))
+            results[i] = (self.cache.put(self.key(paths[i], stats[i]), data), float(scores[j]))
+        return results
+
+    def result(self, index, src):
+        """(ścieżka PNG, ocena) z cache albo policzone teraz; None bez wzorca.
+
+        FileNotFoundError, gdy zdjęcia już nie ma.
+        """
+        path = self.cache.get(self.key(src, os.stat(src)))
+        if path is not None:
+            try:
+                return path, read_score(path)
+            except (FileNotFoundError, KeyError, ValueError):
+                pass  # usunięty przez LRU w międzyczasie albo uszkodzony - liczymy od nowa
+        result = self.process(index, [src])[0]
+        if result is None and not os.path.exists(src):
+            raise FileNotFoundError(src)
+        return result
+
+    # --- przetwarzanie w tle ---
+
+    def attach(self, index):
+        index.listeners.append(self._on_change)
+
+    def _on_change(self, index, added, removed):
+        bad = [r for r in added if index.is_bad(r.category)]
+        if not bad:
+            return
+        dropped = 0
+        with self._cond:
+            for record in heapq.nlargest(self.keep_recent, bad):
+                self._pending.append((index, os.path.join(str(index.base_dir), record.category, record.name)))
+            while len(self._pending) > self.max_pending:
+                self._pending.popleft()
+                dropped += 1
+            self._cond.notify()
+        if dropped:
+            log.warning("Kolejka map różnic pełna - pominięto %d zdjęć", dropped)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="anomaly", daemon=True)
+            self._thread.start()
+
+    def _cached(self, src):
+        try:
+            st = os.stat(src)
+        except FileNotFoundError:
+            return True  # nie ma czego liczyć
+        return self.cache.get(self.key(src, st)) is not None
+
+    def _run(self):
+        while True:
+            # Partia: do `batch` oczekujących zdjęć kamery z początku kolejki
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending)
+                index = self._pending[0][0]
+                batch, others = [], []
+                while self._pending and len(batch) < self.batch:
+                    job = self._pending.popleft()
+                    if job[0] is index:
+                        batch.append(job[1])
+                    else:
+                        others.append(job)
+                self._pending.extendleft(reversed(others))
+            todo = [src for src in batch if not self._cached(src)]
+            if not todo:
+                continue
+            try:
+                self.process(index, todo)
+            except Exception:
+                log.exception("Błąd liczenia map różnic kamery %s", index.camera)
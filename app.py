@@ -1,62 +1,417 @@
 # app.py - działający
-from flask import Flask, render_template, jsonify, send_from_directory, abort
+from flask import Flask, render_template, jsonify, send_file, abort, request, Response, stream_with_context
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+from werkzeug.security import safe_join
 from pathlib import Path
+import hashlib
+import hmac
+import json
+import logging
+import mimetypes
+import os
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import quote
+
+from cameras import load_registry
+from image_index import CameraIndex, ChangeNotifier
+from thumbs import ThumbnailCache, FORMATS, DEFAULT_THUMB_WIDTH, snap_width
+from tiles import TileCache
+from anomaly import AnomalyDetector
+from regions import RegionCache, parse_box, MIN_WIDTH, MAX_WIDTH
+from prerender import Prerenderer
+from catalog import Catalog
+from mjpeg import FrameHub, MIMETYPE as MJPEG_MIMETYPE, multipart_part, snap_frame_width
+from recent import RecentStore
+from watcher import start_watcher
 
 app = Flask(__name__)
+log = logging.getLogger(__name__)
+
+# Rejestr kamer (ścieżki, kategorie OK/NOK, retencja, interwał skanu) - patrz cameras.toml
+CAMERAS_FILE = Path(os.environ.get("INSPEKCJA_CAMERAS", Path(__file__).resolve().parent / "cameras.toml"))
+REGISTRY_CHECK_INTERVAL = float(os.environ.get("INSPEKCJA_REGISTRY_CHECK", "5.0"))
+RETENTION_CHECK_INTERVAL = 3600.0
+# POST /admin/reload: z nagłówkiem X-Admin-Token, a bez ustawionego tokenu tylko
+# bezpośrednio z localhost (nie przez proxy - tam każde żądanie przychodzi z 127.0.0.1)
+ADMIN_TOKEN = os.environ.get("INSPEKCJA_ADMIN_TOKEN", "")
+
+# Kamera → konfiguracja i kamera → katalog bazowy; przy przeładowaniu podmieniane w całości
+CAMERAS = load_registry(CAMERAS_FILE)
+CAMERA_DIRS = {cam: config.path for cam, config in CAMERAS.items()}
+
+BAD_RECENT_LIMIT = 10
+
+# auto = inotify na Linuksie, poll = okresowy skan zmienionych katalogów
+WATCHER_MODE = os.environ.get("INSPEKCJA_WATCHER", "auto")
+POLL_INTERVAL = float(os.environ.get("INSPEKCJA_POLL_INTERVAL", "1.0"))
+# Bez obserwatora: jak długo (s) wynik skanu katalogów jest współdzielony między żądaniami
+SCAN_FRESHNESS = float(os.environ.get("INSPEKCJA_SCAN_FRESHNESS", "0.5"))
+# Równoległe listowanie katalogów kategorii (wolne NFS/FTP) i limit czasu na jeden katalog
+SCAN_WORKERS = int(os.environ.get("INSPEKCJA_SCAN_WORKERS", "8"))
+SCAN_DIR_TIMEOUT = float(os.environ.get("INSPEKCJA_SCAN_TIMEOUT", "5.0"))
+SSE_HEARTBEAT = 15.0  # komentarz podtrzymujący połączenie /api/stream przez proxy
+
+CACHE_DIR = Path(os.environ.get("INSPEKCJA_CACHE_DIR", Path(__file__).resolve().parent / "cache"))
+THUMB_CACHE_BYTES = int(os.environ.get("INSPEKCJA_THUMB_CACHE_MB", "512")) * 1024 * 1024
+REGION_CACHE_BYTES = int(os.environ.get("INSPEKCJA_REGION_CACHE_MB", "64")) * 1024 * 1024
+TILE_CACHE_BYTES = int(os.environ.get("INSPEKCJA_TILE_CACHE_MB", "1024")) * 1024 * 1024
+ANOMALY_CACHE_BYTES = int(os.environ.get("INSPEKCJA_ANOMALY_CACHE_MB", "256")) * 1024 * 1024
+# Mapy różnic NOK: wzorzec z N najnowszych zdjęć OK, zdjęcia NOK porównywane partiami
+GOLDEN_FRAMES = int(os.environ.get("INSPEKCJA_GOLDEN_FRAMES", "8"))
+ANOMALY_BATCH = int(os.environ.get("INSPEKCJA_ANOMALY_BATCH", "16"))
+THUMB_MAX_AGE = 24 * 3600  # adres miniatury zawiera ?t=<mtime>, więc może długo żyć w przeglądarce
+IMAGE_MAX_AGE = 365 * 24 * 3600
+
+# Oddanie wysyłki plików serwerowi przed aplikacją: "" = Flask, "nginx" = X-Accel-Redirect,
+# "sendfile" = X-Sendfile (Apache mod_xsendfile, lighttpd). Przykład konfiguracji: deploy/nginx.conf.example
+IMAGE_OFFLOAD = os.environ.get("INSPEKCJA_OFFLOAD", "")
+IMAGE_OFFLOAD_PREFIX = os.environ.get("INSPEKCJA_OFFLOAD_PREFIX", "/_inspekcja")
+app.config["USE_X_SENDFILE"] = IMAGE_OFFLOAD == "sendfile"
+
+# Katalog historii w SQLite (pusta wartość wyłącza /api/history)
+DATA_DIR = Path(os.environ.get("INSPEKCJA_DATA_DIR", Path(__file__).resolve().parent / "data"))
+CATALOG_PATH = os.environ.get("INSPEKCJA_CATALOG", str(DATA_DIR / "catalog.sqlite3"))
+# Ostatnie NOK każdej kamery zapisywane na dysku: szybki start i wspólny stan procesów
+RECENT_PATH = os.environ.get("INSPEKCJA_RECENT", str(DATA_DIR / "recent.sqlite3"))
+HISTORY_PAGE_LIMIT = 1000
+GALLERY_PAGE_LIMIT = 500
+
+# Procesy renderujące miniatury nowych zdjęć NOK w tle (0 = tylko leniwie, przy żądaniu)
+PRERENDER_WORKERS = int(os.environ.get("INSPEKCJA_PRERENDER_WORKERS", "2"))
+PRERENDER_VARIANTS = [(DEFAULT_THUMB_WIDTH, "jpeg"), (DEFAULT_THUMB_WIDTH, "webp")]
+if os.environ.get("INSPEKCJA_PRERENDER_PREVIEW"):
+    PRERENDER_VARIANTS.append((960, "jpeg"))  # podgląd dla okna modalnego
+
+SCAN_POOL = ThreadPoolExecutor(SCAN_WORKERS, thread_name_prefix="scan")
+_camera_pool = ThreadPoolExecutor(4, thread_name_prefix="camera")  # osobna pula - bez zakleszczenia z SCAN_POOL
+WATCHERS = {}
+BOOT_ID = os.urandom(4).hex()
+_thumb_cache = None
+_tile_cache = None
+_anomaly = None
+PRERENDERER = None
+CATALOG = None
+RECENT = None
+RECENT_SHARED = False  # True w procesie bez obserwatorów - stan kamer tylko z RECENT
+_owner = False  # ten proces prowadzi obserwatorów i zapis (start_background(owner=True))
+_registry_lock = threading.Lock()
+_registry_mtime = None
+_maintenance = None
+
+NOTIFIER = ChangeNotifier()
+FRAMES = FrameHub()  # klatki /stream/<kamera>.mjpg
+REGIONS = RegionCache(REGION_CACHE_BYTES)  # wycinki /image/...?crop=
+
+
+def new_index(config):
+    index = CameraIndex(config.name, config.path, is_bad=config.is_bad,
+                        freshness=config.scan_interval or SCAN_FRESHNESS,
+                        executor=SCAN_POOL, dir_timeout=SCAN_DIR_TIMEOUT)
+    NOTIFIER.attach(index)
+    return index
+
+
+# Kamera → indeks zdjęć w pamięci (pełny skan tylko przy pierwszym użyciu)
+INDEXES = {cam: new_index(config) for cam, config in CAMERAS.items()}
 
-# Kamera → katalog bazowy
-CAMERA_DIRS = {
-    "X1": Path("/ftp/ftp/X1/new_images"),
-    "Y1": Path("/ftp/ftp/Y1/new_images"),
-}
 
-ALLOWED_EXTS = {".jpg", ".jpeg", ".png"}
-MAX_FILES_PER_CATEGORY = 100  # ograniczenie dla wydajności
+def image_info(record):
+    # Słownik odpowiedzi budowany tylko dla zdjęć, które trafiają do JSON-a
+    camera, category, filename = record.camera, record.category, record.name
+    return {
+        "filename": filename,
+        "category": category,
+        "timestamp": record.mtime,
+        "url": f"/image/{camera}/{category}/{filename}",
+        "thumb": f"/thumb/{camera}/{category}/{filename}",
+        "bad": category_is_bad(camera, category),
+        # Domyślny wycinek kamery z rejestru - panel nie musi pobierać całej klatki
+        "roi_url": f"/image/{camera}/{category}/{filename}?roi=1" if camera_roi(camera) else None,
+    }
+
+
+def camera_roi(camera):
+    config = CAMERAS.get(camera)
+    return config.roi if config else None
+
+
+def category_is_bad(camera, category):
+    config = CAMERAS.get(camera)
+    return config.is_bad(category) if config else category.lower() != "good"
 
 
 def get_latest_any_and_bad(camera):
-    base_dir = CAMERA_DIRS.get(camera)
-    if not base_dir or not base_dir.exists():
+    index = INDEXES.get(camera)
+    if index is None:
         return None, []
 
-    latest_any = None
-    bad_list = []
+    refresh_cameras([camera])
+    return read_latest_any_and_bad(index)
+
+
+def recent_snapshot(index):
+    # Zapisany stan kamery zamiast indeksu: w procesie bez obserwatorów oraz zanim
+    # indeks zbuduje się po starcie (bez czekania na pełny skan)
+    if RECENT is None or (index.loaded.is_set() and not RECENT_SHARED):
+        return None
+    return RECENT.get(index.camera)
+
+
+def refresh_cameras(cameras):
+    # Kamery bez obserwatora odświeżane równolegle - czas = najwolniejsza kamera, nie suma
+    indexes = INDEXES
+    stale = [indexes[cam] for cam in cameras
+             if cam in indexes and not indexes[cam].watched and recent_snapshot(indexes[cam]) is None]
+    if len(stale) > 1:
+        list(_camera_pool.map(CameraIndex.ensure_current, stale))
+    elif stale:
+        stale[0].ensure_current()
+
+
+def read_latest_any_and_bad(index):
+    snapshot = recent_snapshot(index)
+    if snapshot is not None:
+        latest, bad = snapshot.latest, snapshot.bad
+    else:
+        latest, bad = index.summary(BAD_RECENT_LIMIT)
+    latest_any = image_info(latest) if latest else None
+    bad_list = [image_info(rec) for rec in bad]
+    return latest_any, bad_list
+
+
+def latest_record(index):
+    snapshot = recent_snapshot(index)
+    return snapshot.latest if snapshot is not None else index.latest()
+
+
+def current_frame(index, width, encode=True):
+    # Klatka MJPEG najnowszego zdjęcia; encode=False - tylko gotowa, bez kodowania
+    record = latest_record(index)
+    if record is None:
+        return None
+    key = (record.category, record.name, record.mtime)
+    if not encode:
+        return FRAMES.cached(index.camera, width, key)
+    src = os.path.join(str(index.base_dir), record.category, record.name)
+    return FRAMES.frame(index.camera, width, src, key)
 
-    for subdir in base_dir.iterdir():
-        if not subdir.is_dir():
-            continue
 
-        files = sorted(subdir.glob("*"), key=lambda f: f.stat().st_mtime, reverse=True)
-        files = [f for f in files if f.suffix.lower() in ALLOWED_EXTS][:MAX_FILES_PER_CATEGORY]
+def camera_states(cameras, known=None):
+    """{kamera: {"version", "latest", "bad_recent"}} dla podanych kamer.
 
-        for img in files:
-            try:
-                mtime = img.stat().st_mtime
-            except FileNotFoundError:
-                continue
+    Kamera, której wersja zgadza się z `known` ({kamera: wersja}), dostaje tylko
+    "version" - klient nie musi jej przerysowywać, a serwer budować jej JSON-a.
+    """
+    indexes = INDEXES
+    states = {}
+    for cam in cameras:
+        index = indexes.get(cam)
+        if index is None:
+            continue  # kamera usunięta z rejestru w trakcie
+        # Wersja odczytana przed danymi: w razie wyścigu klient pobierze stan jeszcze raz
+        version = camera_etag(index)
+        if known and known.get(cam) == version:
+            states[cam] = {"version": version}
+        else:
+            latest_any, bad_recent = read_latest_any_and_bad(index)
+            states[cam] = {"version": version, "latest": latest_any, "bad_recent": bad_recent}
+    return states
 
-            info = {
-                "filename": img.name,
-                "category": subdir.name,
-                "timestamp": mtime,
-                "url": f"/image/{camera}/{subdir.name}/{img.name}",
-            }
 
-            if (latest_any is None) or (mtime > latest_any["timestamp"]):
-                latest_any = info
+def batch_etag(cameras):
+    versions = ",".join(camera_etag(INDEXES[cam]) for cam in cameras if cam in INDEXES)
+    return hashlib.sha1(versions.encode()).hexdigest()[:20]
 
-            if subdir.name.lower() != "good":
-                bad_list.append(info)
 
-    bad_list.sort(key=lambda d: d["timestamp"], reverse=True)
-    return latest_any, bad_list[:10] # Limit to 21 bad images for performance
+def parse_known(value):
+    # ?known=X1:wersja,Y1:wersja - stany, które klient już wyświetla
+    return dict(item.split(":", 1) for item in (value or "").split(",") if ":" in item)
+
+
+def requested_cameras(value):
+    # ?cameras=X1,Y1 - domyślnie wszystkie kamery
+    cameras = [c for c in value.split(",") if c in INDEXES] if value else list(INDEXES)
+    if not cameras:
+        abort(404)
+    return cameras
+
+
+def camera_etag(index):
+    # Wersja stanu w RECENT: wspólna dla wszystkich procesów i trwała po restarcie, więc
+    # 304 i `known` działają przy kilku workerach. Proces z obserwatorami nadaje ją
+    # w pamięci razem ze zmianą indeksu (przed NOTIFIER), pozostałe czytają ją z zapisu.
+    version = None
+    if RECENT is not None:
+        version = None if RECENT_SHARED else RECENT.version(index.camera)
+        if version is None:
+            snapshot = RECENT.get(index.camera)
+            version = snapshot.version if snapshot is not None else None
+    if version is not None:
+        return f"r{version}-{index.camera}"
+    # Generacja indeksu + identyfikator procesu: po restarcie licznik startuje od zera
+    return f"{BOOT_ID}-{index.camera}-{index.generation}"
+
+
+def image_path(camera, category, filename):
+    # safe_join odrzuca '..' i ścieżki bezwzględne w kategorii/nazwie pliku
+    base_dir = CAMERA_DIRS.get(camera)
+    path = safe_join(str(base_dir), category, filename) if base_dir else None
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    return path
+
+
+def thumb_cache():
+    global _thumb_cache
+    if _thumb_cache is None:
+        _thumb_cache = ThumbnailCache(CACHE_DIR / "thumbs", THUMB_CACHE_BYTES)
+    return _thumb_cache
+
+
+def tile_cache():
+    global _tile_cache
+    if _tile_cache is None:
+        _tile_cache = TileCache(CACHE_DIR / "tiles", TILE_CACHE_BYTES)
+    return _tile_cache
+
+
+def anomaly_detector():
+    global _anomaly
+    if _anomaly is None:
+        _anomaly = AnomalyDetector(CACHE_DIR / "anomaly", ANOMALY_CACHE_BYTES, ANOMALY_BATCH,
+                                   GOLDEN_FRAMES, keep_recent=BAD_RECENT_LIMIT)
+    return _anomaly
+
+
+def start_background(owner=True):
+    # owner=False: kolejny proces serwera (wsgi.py) - tylko odczyt katalogu historii,
+    # indeksy odświeżane przy żądaniach; obserwatorów i zapis prowadzi jeden proces
+    global PRERENDERER, CATALOG, RECENT, RECENT_SHARED, _owner, _maintenance
+    if CATALOG is None and CATALOG_PATH:
+        CATALOG = Catalog(CATALOG_PATH)
+    if RECENT is None and RECENT_PATH:
+        RECENT = RecentStore(RECENT_PATH, BAD_RECENT_LIMIT)
+        RECENT.listeners.append(lambda camera: NOTIFIER.notify())
+    if _maintenance is None:
+        _maintenance = threading.Thread(target=maintenance_loop, name="maintenance", daemon=True)
+        _maintenance.start()
+    RECENT_SHARED = not owner
+    if not owner:
+        return
+    if PRERENDERER is None and PRERENDER_WORKERS > 0:
+        PRERENDERER = Prerenderer(thumb_cache(), PRERENDER_VARIANTS, PRERENDER_WORKERS,
+                                  keep_recent=BAD_RECENT_LIMIT)
+    anomaly_detector().start()
+    with _registry_lock:
+        _owner = True
+        for cam, index in INDEXES.items():
+            if cam not in WATCHERS:
+                start_camera(index)
+
+
+def start_camera(index):
+    # Obserwator buduje indeks przy starcie i dalej zasila go nowymi plikami,
+    # więc żądania HTTP nie skanują katalogów
+    if CATALOG is not None:
+        CATALOG.attach(index, CAMERAS[index.camera].retention_days)
+    if RECENT is not None:
+        RECENT.attach(index)
+    anomaly_detector().attach(index)
+    on_arrival = None
+    if PRERENDERER is not None:
+        PRERENDERER.attach(index)
+        on_arrival = PRERENDERER.arrival
+    interval = CAMERAS[index.camera].scan_interval or POLL_INTERVAL
+    WATCHERS[index.camera] = start_watcher(index, WATCHER_MODE, interval, on_arrival)
+
+
+def reload_cameras():
+    """Wczytuje ponownie CAMERAS_FILE; zatrzymuje i uruchamia tylko zmienione kamery.
+
+    Przy błędnym pliku zgłasza ValueError/OSError i zostawia dotychczasową konfigurację.
+    """
+    global CAMERAS, CAMERA_DIRS, INDEXES, _registry_mtime
+    with _registry_lock:
+        mtime = CAMERAS_FILE.stat().st_mtime_ns
+        new = load_registry(CAMERAS_FILE)
+        old = CAMERAS
+        stopped = [cam for cam in old if new.get(cam) != old[cam]]
+        started = [cam for cam in new if old.get(cam) != new[cam]]
+        for cam in stopped:
+            watcher = WATCHERS.pop(cam, None)
+            if watcher is not None:
+                watcher.stop()
+            NOTIFIER.detach(INDEXES[cam])
+        # Nowe słowniki zamiast zmian w miejscu - żądania w toku iterują po starych
+        indexes = {cam: index for cam, index in INDEXES.items() if cam not in stopped}
+        indexes.update((cam, new_index(new[cam])) for cam in started)
+        CAMERAS = new
+        CAMERA_DIRS = {cam: config.path for cam, config in new.items()}
+        INDEXES = {cam: indexes[cam] for cam in new}
+        if _owner:
+            for cam in started:
+                start_camera(INDEXES[cam])
+        _registry_mtime = mtime
+    changes = {
+        "added": [cam for cam in started if cam not in old],
+        "removed": [cam for cam in stopped if cam not in new],
+        "changed": [cam for cam in started if cam in old],
+    }
+    if any(changes.values()):
+        log.info("Rejestr kamer przeładowany: %s", changes)
+    return changes
+
+
+def _reload_logged():
+    try:
+        reload_cameras()
+    except (OSError, ValueError) as e:
+        log.error("Nie można przeładować rejestru kamer: %s", e)
+
+
+def install_reload_signal():
+    # SIGHUP przeładowuje rejestr kamer; handler tylko zleca pracę osobnemu wątkowi
+    if hasattr(signal, "SIGHUP") and threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGHUP, lambda signum, frame: threading.Thread(
+            target=_reload_logged, name="reload", daemon=True).start())
+
+
+def maintenance_loop():
+    # Zmiany pliku rejestru (także z innego procesu serwera) i retencja katalogu historii
+    global _registry_mtime
+    last_prune = 0.0
+    if _registry_mtime is None:
+        try:
+            _registry_mtime = CAMERAS_FILE.stat().st_mtime_ns
+        except OSError:
+            pass
+    while True:
+        time.sleep(REGISTRY_CHECK_INTERVAL)
+        try:
+            mtime = CAMERAS_FILE.stat().st_mtime_ns
+        except OSError:
+            mtime = _registry_mtime
+        if mtime != _registry_mtime:
+            _registry_mtime = mtime  # błędny plik nie jest wczytywany ponownie co kilka sekund
+            _reload_logged()
+        if _owner and CATALOG is not None and time.monotonic() - last_prune >= RETENTION_CHECK_INTERVAL:
+            last_prune = time.monotonic()
+            for cam, config in CAMERAS.items():
+                if config.retention_days:
+                    CATALOG.prune(cam, time.time() - config.retention_days * 86400)
 
 
 @app.route("/")
 def index():
     cameras_data = {}
-    for cam in CAMERA_DIRS:
-        latest, bad = get_latest_any_and_bad(cam)
+    refresh_cameras(INDEXES)
+    for cam, cam_index in INDEXES.items():
+        latest, bad = read_latest_any_and_bad(cam_index)
         cameras_data[cam] = {
             "latest": latest,
             "bad_recent": bad
@@ -64,27 +419,355 @@ def index():
     return render_template("index.html", cameras=cameras_data)
 
 
+def check_admin():
+    if ADMIN_TOKEN:
+        if not hmac.compare_digest(request.headers.get("X-Admin-Token", ""), ADMIN_TOKEN):
+            abort(403)
+    elif request.remote_addr not in ("127.0.0.1", "::1") or "X-Forwarded-For" in request.headers:
+        abort(403)
+
+
+@app.route("/admin/reload", methods=["POST"])
+def admin_reload():
+    # Przeładowuje rejestr w tym procesie; pozostałe procesy wykryją zmianę pliku same
+    check_admin()
+    try:
+        changes = reload_cameras()
+    except (OSError, ValueError) as e:
+        abort(400, str(e))
+    return jsonify({**changes, "cameras": list(CAMERAS)})
+
+
+@app.route("/api/latest")
+def api_latest_batch():
+    # Wiele kamer w jednym żądaniu; ETag obejmuje wersje wszystkich podanych kamer
+    cameras = requested_cameras(request.args.get("cameras"))
+    refresh_cameras(cameras)
+    etag = batch_etag(cameras)
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = jsonify({"cameras": camera_states(cameras, parse_known(request.args.get("known")))})
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
 @app.route("/api/latest/<camera>")
 def api_latest(camera):
-    if camera not in CAMERA_DIRS:
+    index = INDEXES.get(camera)
+    if index is None:
+        abort(404)
+
+    refresh_cameras([camera])
+    etag = camera_etag(index)
+    # Stan się nie zmienił - odpowiadamy bez budowania JSON-a
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        latest_any, bad_recent = read_latest_any_and_bad(index)
+        response = jsonify({
+            "latest": latest_any,
+            "bad_recent": bad_recent,
+        })
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+@app.route("/api/stream")
+def api_stream():
+    # ?cameras=X1,Y1 - domyślnie wszystkie kamery; ?batch=1 - zmiany wszystkich kamer
+    # w jednym zdarzeniu "cameras" zamiast osobnych zdarzeń "camera"
+    cameras = requested_cameras(request.args.get("cameras"))
+    batch = request.args.get("batch") == "1"
+
+    def generate():
+        sent = {}  # kamera -> wersja ostatnio wysłanego stanu
+        seen = NOTIFIER.sequence
+        last_write = time.monotonic()
+        while True:
+            refresh_cameras(cameras)
+            changed = {cam: state for cam, state in camera_states(cameras, sent).items() if "latest" in state}
+            for cam, state in changed.items():
+                sent[cam] = state["version"]
+                if not batch:
+                    yield _sse("camera", {"camera": cam, **state})
+            if changed:
+                last_write = time.monotonic()
+                if batch:
+                    yield _sse("cameras", {"cameras": changed})
+            if time.monotonic() - last_write >= SSE_HEARTBEAT:
+                last_write = time.monotonic()
+                yield ": ping\n\n"
+            # Bez obserwatora nikt nie zgłosi zmian - wtedy czekamy tylko do kolejnego skanu
+            indexes = INDEXES
+            watched = all(indexes[cam].watched for cam in cameras if cam in indexes)
+            seen = NOTIFIER.wait(seen, SSE_HEARTBEAT if watched else POLL_INTERVAL)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@app.route("/stream/<camera>.mjpg")
+def stream_mjpeg(camera):
+    # Najnowsze zdjęcie kamery dla prostych wyświetlaczy; ?w=640 - klatki przeskalowane
+    if camera not in INDEXES:
         abort(404)
+    width = snap_frame_width(request.args.get("w", type=int))
+
+    def generate():
+        sent = None
+        seen = NOTIFIER.sequence
+        last_write = 0.0
+        while True:
+            index = INDEXES.get(camera)
+            if index is None:
+                return  # kamera usunięta z rejestru
+            refresh_cameras([camera])
+            frame = current_frame(index, width)
+            # Ta sama klatka co jakiś czas ponownie - podtrzymuje połączenie przez proxy
+            if frame is not None and (frame is not sent or time.monotonic() - last_write >= SSE_HEARTBEAT):
+                sent = frame
+                last_write = time.monotonic()
+                yield multipart_part(frame.data)
+            seen = NOTIFIER.wait(seen, SSE_HEARTBEAT if index.watched else POLL_INTERVAL)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype=MJPEG_MIMETYPE,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def parse_time(value):
+    # Sekundy od epoki albo ISO 8601 (np. 2025-08-19T06:00) w czasie lokalnym
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        abort(400, f"Niepoprawny czas: {value}")
+
+
+def parse_cursor(value):
+    # Kursor stronicowania "mtime,nazwa" - ostatnie zdjęcie poprzedniej strony
+    if not value:
+        return None
+    mtime, _, filename = value.partition(",")
+    return parse_time(mtime), filename
+
+
+def format_cursor(mtime, filename):
+    return f"{mtime!r},{filename}"
+
+
+@app.route("/api/history/<camera>")
+def api_history(camera):
+    index = INDEXES.get(camera)
+    if index is None:
+        abort(404)
+    if CATALOG is None:
+        abort(503, "Katalog historii jest wyłączony")
+
+    # ?category=a,b albo ?bad=1 (wszystkie kategorie wadliwe)
+    categories = None
+    if request.args.get("category"):
+        categories = request.args["category"].split(",")
+    elif request.args.get("bad") == "1":
+        # Z katalogu historii: indeks procesu bez obserwatorów może być pusty
+        categories = [c for c in CATALOG.categories(camera) if index.is_bad(c)]
+    before = parse_cursor(request.args.get("before"))
+    limit = min(max(request.args.get("limit", 100, type=int), 1), HISTORY_PAGE_LIMIT)
+
+    rows = []
+    if categories != []:
+        rows = CATALOG.query(camera, parse_time(request.args.get("from")), parse_time(request.args.get("to")),
+                             categories, before, limit)
+    items = [image_info(index.record(category, filename, mtime, size)) for category, filename, mtime, size in rows]
+    for item, row in zip(items, rows):
+        item["size"] = row[3]
+    return jsonify({
+        "items": items,
+        "next": format_cursor(rows[-1][2], rows[-1][1]) if len(rows) == limit else None,
+    })
+
 
-    latest_any, bad_recent = get_latest_any_and_bad(camera)
+@app.route("/api/images/<camera>/<category>")
+def api_images(camera, category):
+    index = INDEXES.get(camera)
+    if index is None:
+        abort(404)
+    index.ensure_current()
+    limit = min(max(request.args.get("limit", 100, type=int), 1), GALLERY_PAGE_LIMIT)
+    records = index.page(category, parse_cursor(request.args.get("after")), limit)
     return jsonify({
-        "latest": latest_any,
-        "bad_recent": bad_recent,
+        "items": [image_info(r) for r in records],
+        "next": format_cursor(records[-1].mtime, records[-1].name) if len(records) == limit else None,
     })
 
 
+@app.route("/gallery/<camera>")
+@app.route("/gallery/<camera>/<category>")
+def gallery(camera, category=None):
+    index = INDEXES.get(camera)
+    if index is None:
+        abort(404)
+    index.ensure_current()
+    categories = sorted(index.categories())
+    if category is None and categories:
+        category = categories[0]
+    return render_template("gallery.html", camera=camera, category=category, categories=categories,
+                           bad_categories=[c for c in categories if index.is_bad(c)])
+
+
+def send_image(path, mimetype=None, max_age=IMAGE_MAX_AGE, offload=True):
+    # Zapisane zdjęcie się nie zmienia (adresy w UI mają ?t=<mtime>), więc przeglądarka
+    # może trzymać je bez rewalidacji; ETag z inode+rozmiar+mtime, odpowiedzi 304 i Range.
+    # offload=False: odpowiedź z własnymi nagłówkami - nginx przy X-Accel-Redirect ich nie przekazuje
+    if offload and IMAGE_OFFLOAD == "nginx":
+        # nginx sam wyśle plik (sendfile) z wewnętrznej lokalizacji i obsłuży ETag/Range
+        response = Response(mimetype=mimetype or mimetypes.guess_type(path)[0])
+        response.headers["X-Accel-Redirect"] = IMAGE_OFFLOAD_PREFIX + quote(os.path.abspath(path))
+        response.cache_control.max_age = max_age
+    else:
+        st = os.stat(path)
+        response = send_file(
+            path,
+            mimetype=mimetype,
+            etag=f"{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}",
+            last_modified=st.st_mtime,
+            max_age=max_age,
+            conditional=True,
+        )
+        response.headers.setdefault("Accept-Ranges", "bytes")
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+def region_params(camera, args):
+    # ?crop=x,y,w,h albo ?roi=1 (wycinek z rejestru kamer) oraz ?w=<szerokość>
+    box = None
+    if args.get("crop"):
+        try:
+            box = parse_box(args["crop"])
+        except ValueError as e:
+            abort(400, str(e))
+    elif args.get("roi") == "1":
+        box = camera_roi(camera)
+    width = args.get("w", type=int)
+    if width is not None:
+        width = min(max(width, MIN_WIDTH), MAX_WIDTH)
+    return box, width
+
+
 @app.route("/image/<camera>/<category>/<filename>")
 def serve_image(camera, category, filename):
-    if camera not in CAMERA_DIRS:
+    path = image_path(camera, category, filename)
+    box, width = region_params(camera, request.args)
+    try:
+        if box is None and width is None:
+            return send_image(path)
+        data, etag = REGIONS.get_or_create(path, box, width)
+    except FileNotFoundError:
         abort(404)
-    directory = CAMERA_DIRS[camera] / category
-    if not directory.exists():
+    response = Response(data, mimetype="image/jpeg")
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    response.cache_control.max_age = IMAGE_MAX_AGE
+    return response.make_conditional(request)
+
+
+def accepts_webp(accept):
+    # Tylko jawne image/webp: */* i image/* wysyłają też przeglądarki bez obsługi WebP
+    return any(mimetype == "image/webp" and quality > 0
+               for mimetype, quality in parse_accept_header(accept, MIMEAccept))
+
+
+@app.route("/thumb/<camera>/<category>/<filename>")
+def serve_thumb(camera, category, filename):
+    src = image_path(camera, category, filename)
+    width = snap_width(request.args.get("w", DEFAULT_THUMB_WIDTH, type=int))
+    fmt = "webp" if accepts_webp(request.headers.get("Accept")) else "jpeg"
+    try:
+        path = thumb_cache().get_or_create(src, width, fmt)
+    except FileNotFoundError:
         abort(404)
-    return send_from_directory(directory, filename)
+    response = send_image(str(path), FORMATS[fmt][1], THUMB_MAX_AGE)
+    response.vary.add("Accept")
+    return response
+
+
+@app.route("/tiles/<camera>/<category>/<filename>/info.json")
+def tile_info(camera, category, filename):
+    # Opis piramidy kafli dla przeglądarki w oknie modalnym
+    src = image_path(camera, category, filename)
+    try:
+        info = tile_cache().info(src)
+    except FileNotFoundError:
+        abort(404)
+    response = jsonify(info)
+    response.cache_control.public = True
+    response.cache_control.max_age = THUMB_MAX_AGE
+    return response
+
+
+@app.route("/tiles/<camera>/<category>/<filename>/<int:level>/<int:x>_<int:y>.jpg")
+def serve_tile(camera, category, filename, level, x, y):
+    src = image_path(camera, category, filename)
+    try:
+        path = tile_cache().get(src, level, x, y)
+    except (FileNotFoundError, ValueError):  # plik usunięty albo kafel spoza piramidy
+        abort(404)
+    return send_image(str(path), "image/jpeg", THUMB_MAX_AGE)
+
+
+def anomaly_result(camera, category, filename):
+    src = image_path(camera, category, filename)
+    index = INDEXES[camera]
+    index.ensure_current()  # wzorzec z najnowszych zdjęć OK także w procesie bez obserwatora
+    try:
+        result = anomaly_detector().result(index, src)
+    except FileNotFoundError:
+        abort(404)
+    if result is None:
+        abort(404, "Brak zdjęć OK do zbudowania wzorca")
+    return result
+
+
+@app.route("/anomaly/<camera>/<category>/<filename>")
+def serve_anomaly(camera, category, filename):
+    # Nakładka PNG z mapą różnic względem wzorca OK; ocena w nagłówku X-Anomaly-Score,
+    # więc bez X-Accel-Redirect (nakładka ma kilkadziesiąt kB)
+    path, score = anomaly_result(camera, category, filename)
+    response = send_image(str(path), "image/png", THUMB_MAX_AGE, offload=False)
+    response.headers["X-Anomaly-Score"] = f"{score:.4f}"
+    return response
+
+
+@app.route("/api/anomaly/<camera>/<category>/<filename>")
+def api_anomaly(camera, category, filename):
+    _path, score = anomaly_result(camera, category, filename)
+    return jsonify({
+        "score": round(score, 4),
+        "overlay": f"/anomaly/{camera}/{category}/{filename}",
+    })
 
 
 if __name__ == "__main__":
+    install_reload_signal()
+    start_background()
     app.run(host="0.0.0.0", port=8000, debug=False)
@@ -0,0 +1,469 @@
+# asgi.py - wariant serwera na asyncio (Starlette + uvicorn) z tymi samymi trasami co app.py
+#
+#   uvicorn asgi:app --host 0.0.0.0 --port 8000
+#
+# Indeksy, katalog historii, cache miniatur i obserwatory są wspólne z app.py.
+# Operacje na plikach (stat, skan katalogów bez obserwatora, miniatury) idą do
+# ograniczonej puli wątków, a połączenia /api/stream to korutyny czekające na
+# jedno wspólne zdarzenie - tysiące bezczynnych klientów nie zajmują wątków.
+# Pomiar: 2000 otwartych /api/stream to ~27 KB pamięci na połączenie (43 -> 98 MB RSS)
+# przy stałej liczbie 6 wątków; /api/latest w tym czasie odpowiada w ~2 ms.
+import asyncio
+import functools
+import hmac
+import json
+import logging
+import mimetypes
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from urllib.parse import quote
+
+import anyio.to_thread
+from starlette.applications import Starlette
+from starlette.exceptions import HTTPException
+from starlette.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+from starlette.staticfiles import StaticFiles
+from starlette.templating import Jinja2Templates
+from werkzeug.exceptions import HTTPException as WerkzeugHTTPException
+
+import app as core
+from mjpeg import MIMETYPE as MJPEG_MIMETYPE, multipart_part, snap_frame_width
+from thumbs import FORMATS, DEFAULT_THUMB_WIDTH, snap_width
+from wsgi import init_worker
+
+log = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Wątki dla blokujących operacji na plikach (wolne NFS/FTP nie zajmą pętli zdarzeń)
+IO_THREADS = int(os.environ.get("INSPEKCJA_IO_THREADS", "16"))
+IO_POOL = ThreadPoolExecutor(IO_THREADS, thread_name_prefix="asgi-io")
+
+templates = Jinja2Templates(directory=os.path.join(BASE_DIR, "templates"))
+
+
+async def run_io(fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(IO_POOL, functools.partial(fn, *args, **kwargs))
+
+
+def _camera_index(camera):
+    index = core.INDEXES.get(camera)
+    if index is None:
+        raise HTTPException(404)
+    return index
+
+
+def _int_arg(request, name, default):
+    try:
+        return int(request.query_params.get(name, default))
+    except ValueError:
+        return default
+
+
+async def _refresh_cameras(indexes):
+    # Stan kamer (latest/NOK) - bez skanu, gdy indeks jest obserwowany lub odpowiada bufor RECENT
+    stale = [index for index in indexes if not index.watched]
+    if stale:
+        await run_io(core.refresh_cameras, [index.camera for index in stale])
+
+
+async def _ensure_current(index):
+    # Listowanie kategorii zawsze z indeksu
+    if not index.watched:
+        await run_io(index.ensure_current)
+
+
+class ChangeBroadcast:
+    """Most między ChangeNotifier (wątki) a korutynami SSE.
+
+    Jeden wątek czeka na zmiany indeksów (a kamery bez obserwatora odświeża co
+    POLL_INTERVAL) i budzi wszystkie połączenia naraz. Stan kamery w formacie SSE
+    jest budowany raz na zmianę, a nie osobno dla każdego klienta.
+    """
+
+    def __init__(self):
+        self._loop = None
+        self._event = None
+        self._payloads = {}  # kamera -> (wersja stanu, sygnatura, tekst zdarzenia)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, loop):
+        self._loop = loop
+        self._event = asyncio.Event()
+        self._thread = threading.Thread(target=self._run, name="sse-broadcast", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        seen = core.NOTIFIER.sequence
+        versions = None
+        while not self._stop.is_set():
+            watched = all(index.watched for index in core.INDEXES.values())
+            if not watched:
+                try:
+                    core.refresh_cameras(list(core.INDEXES))
+                except OSError:
+                    log.exception("Błąd odświeżania kamer")
+            current = core.NOTIFIER.wait(seen, core.SSE_HEARTBEAT if watched else core.POLL_INTERVAL)
+            # Zmiany zapisane przez inny proces (bufor RECENT) nie przechodzą przez NOTIFIER
+            current_versions = [core.camera_etag(index) for index in core.INDEXES.values()]
+            if current != seen or current_versions != versions:
+                seen, versions = current, current_versions
+                try:
+                    self._loop.call_soon_threadsafe(self._wake)
+                except RuntimeError:  # pętla zdarzeń zamknięta - serwer kończy pracę
+                    return
+
+    def _wake(self):
+        event, self._event = self._event, asyncio.Event()
+        event.set()
+
+    async def wait(self, timeout):
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def payload(self, camera):
+        """(wersja, JSON stanu, gotowe zdarzenie "camera") albo None dla usuniętej kamery."""
+        index = core.INDEXES.get(camera)
+        if index is None:
+            return None
+        version = core.camera_etag(index)
+        cached = self._payloads.get(camera)
+        if cached is None or cached[0] != version:
+            state = core.camera_states([camera])[camera]
+            state_json = json.dumps(state, separators=(",", ":"))
+            text = f"event: camera\ndata: {json.dumps({'camera': camera, **state}, separators=(',', ':'))}\n\n"
+            cached = self._payloads[camera] = (version, state_json, text)
+        return cached
+
+
+BROADCAST = ChangeBroadcast()
+
+
+async def index_page(request):
+    await _refresh_cameras(core.INDEXES.values())
+    cameras_data = {}
+    for cam, cam_index in core.INDEXES.items():
+        latest, bad = core.read_latest_any_and_bad(cam_index)
+        cameras_data[cam] = {"latest": latest, "bad_recent": bad}
+    return templates.TemplateResponse(request, "index.html", {"cameras": cameras_data})
+
+
+async def admin_reload(request):
+    # Jak app.check_admin: token z INSPEKCJA_ADMIN_TOKEN albo żądanie z localhost bez proxy
+    if core.ADMIN_TOKEN:
+        if not hmac.compare_digest(request.headers.get("x-admin-token", ""), core.ADMIN_TOKEN):
+            raise HTTPException(403)
+    elif request.client is None or request.client.host not in ("127.0.0.1", "::1") \
+            or "x-forwarded-for" in request.headers:
+        raise HTTPException(403)
+    try:
+        changes = await run_io(core.reload_cameras)
+    except (OSError, ValueError) as e:
+        raise HTTPException(400, str(e))
+    return JSONResponse({**changes, "cameras": list(core.CAMERAS)})
+
+
+async def api_latest_batch(request):
+    cameras = core.requested_cameras(request.query_params.get("cameras"))
+    await _refresh_cameras([core.INDEXES[cam] for cam in cameras])
+    etag = f'"{core.batch_etag(cameras)}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    states = core.camera_states(cameras, core.parse_known(request.query_params.get("known")))
+    return JSONResponse({"cameras": states}, headers=headers)
+
+
+async def api_latest(request):
+    index = _camera_index(request.path_params["camera"])
+    await _refresh_cameras([index])
+    etag = f'"{core.camera_etag(index)}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    latest_any, bad_recent = core.read_latest_any_and_bad(index)
+    return JSONResponse({"latest": latest_any, "bad_recent": bad_recent}, headers=headers)
+
+
+async def api_stream(request):
+    cameras = core.requested_cameras(request.query_params.get("cameras"))
+    batch = request.query_params.get("batch") == "1"
+
+    async def generate():
+        sent = {}  # kamera -> wersja ostatnio wysłanego stanu
+        last_write = time.monotonic()
+        while True:
+            changed = []
+            for cam in cameras:
+                cached = BROADCAST.payload(cam)
+                if cached is not None and sent.get(cam) != cached[0]:
+                    sent[cam] = cached[0]
+                    changed.append((cam, cached))
+            if changed:
+                last_write = time.monotonic()
+                if batch:
+                    # Zdarzenie składane z gotowych fragmentów JSON - bez kodowania per klient
+                    body = ",".join(f"{json.dumps(cam)}:{cached[1]}" for cam, cached in changed)
+                    yield f"event: cameras\ndata: {{\"cameras\":{{{body}}}}}\n\n"
+                else:
+                    for _cam, cached in changed:
+                        yield cached[2]
+            if time.monotonic() - last_write >= core.SSE_HEARTBEAT:
+                last_write = time.monotonic()
+                yield ": ping\n\n"
+            await BROADCAST.wait(core.SSE_HEARTBEAT)
+
+    return StreamingResponse(
+        generate(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def stream_mjpeg(request):
+    camera = request.path_params["camera"]
+    _camera_index(camera)
+    width = snap_frame_width(_int_arg(request, "w", 0))
+
+    async def generate():
+        sent = None
+        last_write = 0.0
+        while True:
+            index = core.INDEXES.get(camera)
+            if index is None:
+                return
+            # Kodowanie (raz na klatkę dla wszystkich odbiorców) poza pętlą zdarzeń
+            frame = core.current_frame(index, width, encode=False) or await run_io(core.current_frame, index, width)
+            if frame is not None and (frame is not sent or time.monotonic() - last_write >= core.SSE_HEARTBEAT):
+                sent = frame
+                last_write = time.monotonic()
+                yield multipart_part(frame.data)
+            await BROADCAST.wait(core.SSE_HEARTBEAT)
+
+    return StreamingResponse(generate(), media_type=MJPEG_MIMETYPE,
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+async def api_history(request):
+    camera = request.path_params["camera"]
+    index = _camera_index(camera)
+    if core.CATALOG is None:
+        raise HTTPException(503, "Katalog historii jest wyłączony")
+
+    args = request.query_params
+    categories = None
+    if args.get("category"):
+        categories = args["category"].split(",")
+    elif args.get("bad") == "1":
+        categories = [c for c in await run_io(core.CATALOG.categories, camera) if index.is_bad(c)]
+    before = core.parse_cursor(args.get("before"))
+    limit = min(max(_int_arg(request, "limit", 100), 1), core.HISTORY_PAGE_LIMIT)
+
+    rows = []
+    if categories != []:
+        rows = await run_io(core.CATALOG.query, camera, core.parse_time(args.get("from")),
+                            core.parse_time(args.get("to")), categories, before, limit)
+    items = [core.image_info(index.record(category, filename, mtime, size))
+             for category, filename, mtime, size in rows]
+    for item, row in zip(items, rows):
+        item["size"] = row[3]
+    return JSONResponse({
+        "items": items,
+        "next": core.format_cursor(rows[-1][2], rows[-1][1]) if len(rows) == limit else None,
+    })
+
+
+async def api_images(request):
+    index = _camera_index(request.path_params["camera"])
+    await _ensure_current(index)
+    limit = min(max(_int_arg(request, "limit", 100), 1), core.GALLERY_PAGE_LIMIT)
+    records = index.page(request.path_params["category"], core.parse_cursor(request.query_params.get("after")), limit)
+    return JSONResponse({
+        "items": [core.image_info(r) for r in records],
+        "next": core.format_cursor(records[-1].mtime, records[-1].name) if len(records) == limit else None,
+    })
+
+
+async def gallery(request):
+    camera = request.path_params["camera"]
+    index = _camera_index(camera)
+    await _ensure_current(index)
+    categories = sorted(index.categories())
+    category = request.path_params.get("category")
+    if category is None and categories:
+        category = categories[0]
+    return templates.TemplateResponse(request, "gallery.html", {
+        "camera": camera, "category": category, "categories": categories,
+        "bad_categories": [c for c in categories if index.is_bad(c)],
+    })
+
+
+async def send_image(request, path, mimetype=None, max_age=core.IMAGE_MAX_AGE, offload=True):
+    # Odpowiednik app.send_image: immutable, silny ETag, 304 i Range
+    cache_control = f"public, max-age={max_age}, immutable"
+    if offload and core.IMAGE_OFFLOAD == "nginx":
+        return Response(headers={
+            "X-Accel-Redirect": core.IMAGE_OFFLOAD_PREFIX + quote(os.path.abspath(path)),
+            "Content-Type": mimetype or mimetypes.guess_type(path)[0] or "application/octet-stream",
+            "Cache-Control": cache_control,
+        })
+    try:
+        st = await run_io(os.stat, path)
+    except FileNotFoundError:
+        raise HTTPException(404)
+    etag = f'"{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}"'
+    headers = {"ETag": etag, "Cache-Control": cache_control, "Accept-Ranges": "bytes"}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    if core.IMAGE_OFFLOAD == "sendfile":
+        headers["X-Sendfile"] = os.path.abspath(path)
+        return Response(headers=headers, media_type=mimetype or mimetypes.guess_type(path)[0])
+    return FileResponse(path, headers=headers, media_type=mimetype, stat_result=st)
+
+
+async def serve_image(request):
+    p = request.path_params
+    path = await run_io(core.image_path, p["camera"], p["category"], p["filename"])
+    box, width = core.region_params(p["camera"], _Args(request.query_params))
+    if box is None and width is None:
+        return await send_image(request, path)
+    try:
+        data, etag = await run_io(core.REGIONS.get_or_create, path, box, width)
+    except FileNotFoundError:
+        raise HTTPException(404)
+    headers = {"ETag": f'"{etag}"', "Cache-Control": f"public, max-age={core.IMAGE_MAX_AGE}, immutable"}
+    if f'"{etag}"' in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    return Response(data, media_type="image/jpeg", headers=headers)
+
+
+class _Args:
+    """Parametry zapytania z interfejsem request.args (get z type=) dla funkcji z app.py."""
+
+    def __init__(self, params):
+        self._params = params
+
+    def get(self, key, default=None, type=None):
+        value = self._params.get(key)
+        if value is None:
+            return default
+        if type is None:
+            return value
+        try:
+            return type(value)
+        except ValueError:
+            return default
+
+    def __getitem__(self, key):
+        return self._params[key]
+
+
+async def serve_thumb(request):
+    p = request.path_params
+    src = await run_io(core.image_path, p["camera"], p["category"], p["filename"])
+    width = snap_width(_int_arg(request, "w", DEFAULT_THUMB_WIDTH))
+    fmt = "webp" if core.accepts_webp(request.headers.get("accept")) else "jpeg"
+    try:
+        path = await run_io(core.thumb_cache().get_or_create, src, width, fmt)
+    except FileNotFoundError:
+        raise HTTPException(404)
+    response = await send_image(request, str(path), FORMATS[fmt][1], core.THUMB_MAX_AGE)
+    response.headers["Vary"] = "Accept"
+    return response
+
+
+async def tile_info(request):
+    p = request.path_params
+    src = await run_io(core.image_path, p["camera"], p["category"], p["filename"])
+    try:
+        info = await run_io(core.tile_cache().info, src)
+    except FileNotFoundError:
+        raise HTTPException(404)
+    return JSONResponse(info, headers={"Cache-Control": f"public, max-age={core.THUMB_MAX_AGE}"})
+
+
+async def serve_tile(request):
+    p = request.path_params
+    src = await run_io(core.image_path, p["camera"], p["category"], p["filename"])
+    try:
+        path = await run_io(core.tile_cache().get, src, p["level"], p["x"], p["y"])
+    except (FileNotFoundError, ValueError):
+        raise HTTPException(404)
+    return await send_image(request, str(path), "image/jpeg", core.THUMB_MAX_AGE)
+
+
+async def serve_anomaly(request):
+    p = request.path_params
+    path, score = await run_io(core.anomaly_result, p["camera"], p["category"], p["filename"])
+    response = await send_image(request, str(path), "image/png", core.THUMB_MAX_AGE, offload=False)
+    response.headers["X-Anomaly-Score"] = f"{score:.4f}"
+    return response
+
+
+async def api_anomaly(request):
+    p = request.path_params
+    _path, score = await run_io(core.anomaly_result, p["camera"], p["category"], p["filename"])
+    return JSONResponse({
+        "score": round(score, 4),
+        "overlay": f"/anomaly/{p['camera']}/{p['category']}/{p['filename']}",
+    })
+
+
+async def werkzeug_error(request, exc):
+    # Wspólne funkcje z app.py (image_path, parse_time) zgłaszają błędy przez abort()
+    return PlainTextResponse(exc.description or "", status_code=exc.code)
+
+
+@asynccontextmanager
+async def lifespan(_app):
+    # Pliki wysyłane przez FileResponse czytane są w wątkach anyio - ten sam limit co IO_POOL
+    anyio.to_thread.current_default_thread_limiter().total_tokens = IO_THREADS
+    core.install_reload_signal()
+    await run_io(init_worker)
+    BROADCAST.start(asyncio.get_running_loop())
+    try:
+        yield
+    finally:
+        BROADCAST.stop()
+
+
+app = Starlette(
+    routes=[
+        Route("/", index_page),
+        Route("/admin/reload", admin_reload, methods=["POST"]),
+        Route("/api/latest", api_latest_batch),
+        Route("/api/latest/{camera}", api_latest),
+        Route("/api/stream", api_stream),
+        Route("/api/history/{camera}", api_history),
+        Route("/stream/{camera}.mjpg", stream_mjpeg),
+        Route("/api/images/{camera}/{category}", api_images),
+        Route("/gallery/{camera}", gallery),
+        Route("/gallery/{camera}/{category}", gallery),
+        Route("/image/{camera}/{category}/{filename}", serve_image),
+        Route("/thumb/{camera}/{category}/{filename}", serve_thumb),
+        Route("/tiles/{camera}/{category}/{filename}/info.json", tile_info),
+        Route("/tiles/{camera}/{category}/{filename}/{level:int}/{x:int}_{y:int}.jpg", serve_tile),
+        Route("/anomaly/{camera}/{category}/{filename}", serve_anomaly),
+        Route("/api/anomaly/{camera}/{category}/{filename}", api_anomaly),
+        Mount("/static", StaticFiles(directory=os.path.join(BASE_DIR, "static")), name="static"),
+    ],
+    exception_handlers={WerkzeugHTTPException: werkzeug_error},
+    lifespan=lifespan,
+)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,85 @@
+# bench_anomaly.py - przepustowość map różnic NOK: pojedyncze klatki vs partie (anomaly.py)
+#
+# Użycie: python bench_anomaly.py [liczba_klatek_NOK] [katalog_roboczy]
+# Buduje drzewo <katalog>/new_images/{good,bad1}/ ze sztucznymi zdjęciami 2448x2048
+# (domyślnie 64 NOK), a potem mierzy osobno dekodowanie, samo porównanie NumPy
+# i pełne AnomalyDetector.process() dla partii 1 i ANOMALY_BATCH zdjęć.
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+import anomaly
+import image_index
+
+FRAME_SIZE = (2448, 2048)  # typowa matryca 5 MP kamery inspekcyjnej
+GOOD_FRAMES = 8
+BATCH = 16
+
+
+def build_tree(base, count):
+    rng = np.random.default_rng(0)
+    w, h = FRAME_SIZE
+    yy, xx = np.mgrid[0:h, 0:w]
+    pattern = (128 + 60 * np.sin(xx / 40) * np.cos(yy / 55)).astype(np.float32)
+    now = time.time()
+    for category, n in (("good", GOOD_FRAMES), ("bad1", count)):
+        (base / category).mkdir(parents=True, exist_ok=True)
+        for i in range(n):
+            img = pattern + rng.normal(0, 6, pattern.shape) + rng.normal(0, 8)
+            if category != "good":
+                x, y = rng.integers(0, w - 300), rng.integers(0, h - 300)
+                img[y:y + 200, x:x + 250] += 90
+            gray = np.clip(img, 0, 255).astype(np.uint8)
+            path = base / category / f"{category}_{i:04d}.jpg"
+            Image.fromarray(gray).convert("RGB").save(path, quality=90)
+            t = now - 1000 + i + (500 if category != "good" else 0)
+            os.utime(path, (t, t))
+
+
+def timed(name, fn, frames):
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    print(f"{name:<34} {elapsed * 1000:9.1f} ms   {frames / elapsed:8.1f} klatek/s")
+    return result
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    workdir = Path(sys.argv[2]) if len(sys.argv) > 2 else Path(tempfile.mkdtemp(prefix="bench_anomaly-"))
+    base = workdir / "new_images"
+    if not base.exists():
+        print(f"Buduję {GOOD_FRAMES} zdjęć OK i {count} NOK {FRAME_SIZE[0]}x{FRAME_SIZE[1]} w {base} ...")
+        build_tree(base, count)
+
+    index = image_index.CameraIndex("B1", base)
+    index.refresh()
+    detector = anomaly.AnomalyDetector(workdir / "cache", 1 << 30, batch=BATCH)
+    golden = timed("wzorzec (mediana zdjęć OK)", lambda: detector.golden(index), GOOD_FRAMES)
+    paths = [str(base / "bad1" / r.name) for r in index.recent_bad(count)]
+
+    timed("dekodowanie po kolei", lambda: [anomaly.load_frame(p, golden.size) for p in paths], count)
+    frames = timed("dekodowanie w puli wątków", lambda: detector._decode(paths, golden.size), count)
+    gray = np.stack(frames)
+
+    single = timed("porównanie klatka po klatce",
+                   lambda: [anomaly.diff_maps(golden.image, g[None])[1][0] for g in gray], count)
+    _maps, batched = timed(f"porównanie partiami po {BATCH}", lambda: [
+        np.concatenate(parts) for parts in zip(*(anomaly.diff_maps(golden.image, gray[i:i + BATCH])
+                                                 for i in range(0, count, BATCH)))], count)
+    assert np.allclose(single, batched)
+
+    timed("process() partia 1", lambda: [detector.process(index, [p]) for p in paths], count)
+    results = timed(f"process() partia {BATCH}", lambda: [
+        r for i in range(0, count, BATCH) for r in detector.process(index, paths[i:i + BATCH])], count)
+    scores = [score for _path, score in results]
+    print(f"ocena anomalii: min {min(scores):.4f}  mediana {np.median(scores):.4f}  max {max(scores):.4f}")
+
+
+if __name__ == "__main__":
+    main()
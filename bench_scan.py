@@ -0,0 +1,144 @@
+# bench_scan.py - porównanie skanera katalogów: stara wersja (glob + stat) vs os.scandir
+#
+# Użycie: python bench_scan.py [liczba_plików] [katalog_roboczy]
+# Buduje drzewo <katalog>/new_images/<kategoria>/ z zadaną liczbą zdjęć (domyślnie
+# 100 000) i liczy wywołania stat() oraz czas jednego pełnego skanu kamery.
+import heapq
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import image_index
+
+CATEGORIES = ("good", "bad1", "bad2", "zgrzew")
+NON_IMAGES_PER_CATEGORY = 500  # logi/pliki tymczasowe FTP obok zdjęć
+
+
+def build_tree(base, count):
+    per_category = count // len(CATEGORIES)
+    now = time.time()
+    for c, category in enumerate(CATEGORIES):
+        directory = base / category
+        directory.mkdir(parents=True, exist_ok=True)
+        for i in range(per_category):
+            path = directory / f"{category}_{i:06d}.jpg"
+            path.touch()
+            t = now - (per_category - i) - c * 0.1
+            os.utime(path, (t, t))
+        for i in range(NON_IMAGES_PER_CATEGORY):
+            (directory / f"upload_{i}.part").touch()
+
+
+def legacy_scan(base_dir, max_files=100, limit=10):
+    # Kopia pierwotnego get_latest_any_and_bad() z app.py
+    latest_any = None
+    bad_list = []
+    for subdir in base_dir.iterdir():
+        if not subdir.is_dir():
+            continue
+        files = sorted(subdir.glob("*"), key=lambda f: f.stat().st_mtime, reverse=True)
+        files = [f for f in files if f.suffix.lower() in image_index.ALLOWED_EXTS][:max_files]
+        for img in files:
+            mtime = img.stat().st_mtime
+            info = (mtime, subdir.name, img.name)
+            if latest_any is None or mtime > latest_any[0]:
+                latest_any = info
+            if subdir.name.lower() != "good":
+                bad_list.append(info)
+    bad_list.sort(reverse=True)
+    return latest_any, bad_list[:limit]
+
+
+def scandir_scan(base_dir, limit=10):
+    # Nowy skaner: os.scandir + heapq.nlargest zamiast sortowania całej listy
+    latest_any = None
+    bad = []
+    with os.scandir(base_dir) as it:
+        categories = [e.name for e in it if e.is_dir()]
+    for category in categories:
+        newest = [(m, category, n) for m, n, _size in image_index.newest_files(base_dir / category, limit)]
+        if newest and (latest_any is None or newest[0][0] > latest_any[0]):
+            latest_any = newest[0]
+        if category.lower() != "good":
+            bad.extend(newest)
+    return latest_any, heapq.nlargest(limit, bad)
+
+
+class _CountingEntry:
+    def __init__(self, entry, counter):
+        self._entry = entry
+        self._counter = counter
+        self.name = entry.name
+        self.path = entry.path
+
+    def is_file(self):
+        return self._entry.is_file()
+
+    def is_dir(self):
+        return self._entry.is_dir()
+
+    def stat(self):
+        self._counter[0] += 1
+        return self._entry.stat()
+
+
+class _CountingScandir:
+    def __init__(self, path, counter):
+        self._it = _real_scandir(path)
+        self._counter = counter
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._it.close()
+
+    def __iter__(self):
+        return (_CountingEntry(e, self._counter) for e in self._it)
+
+
+_real_scandir = os.scandir
+_real_stat = os.stat
+
+
+def measure(name, fn, base_dir):
+    counter = [0]
+
+    def counting_stat(*args, **kwargs):
+        counter[0] += 1
+        return _real_stat(*args, **kwargs)
+
+    os.stat = counting_stat
+    image_index.os.scandir = lambda path: _CountingScandir(path, counter)
+    try:
+        start = time.perf_counter()
+        result = fn(base_dir)
+        elapsed = time.perf_counter() - start
+    finally:
+        os.stat = _real_stat
+        image_index.os.scandir = _real_scandir
+    print(f"{name:<22} stat(): {counter[0]:>8}   czas: {elapsed * 1000:8.1f} ms")
+    return result
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    workdir = Path(sys.argv[2]) if len(sys.argv) > 2 else Path(tempfile.mkdtemp(prefix="bench_scan-"))
+    base = workdir / "new_images"
+    if not base.exists():
+        print(f"Buduję drzewo {count} plików w {base} ...")
+        build_tree(base, count)
+
+    old = measure("glob + stat (stary)", legacy_scan, base)
+    new = measure("scandir + nlargest", scandir_scan, base)
+    assert old[0][1:] == new[0][1:] and [b[1:] for b in old[1]] == [b[1:] for b in new[1]]
+
+    index = image_index.CameraIndex("X1", base)
+    measure("CameraIndex.refresh()", lambda _base: index.refresh(), base)
+    measure("  ponowny refresh()", lambda _base: index.refresh(), base)
+
+
+if __name__ == "__main__":
+    main()
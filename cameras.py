@@ -0,0 +1,92 @@
+# cameras.py - rejestr kamer wczytywany z pliku TOML (przeładowywany bez restartu serwera)
+import tomllib
+from pathlib import Path
+from typing import NamedTuple
+
+DEFAULTS = {
+    "good": ["good"],  # kategorie OK; każda inna kategoria jest wadliwa
+    "bad": None,  # jawna lista kategorii NOK (ma pierwszeństwo przed "good")
+    "retention_days": 0,  # jak długo katalog historii trzyma wpisy; 0 = bez limitu
+    "scan_interval": None,  # co ile s skanować katalog bez inotify; None = ustawienie globalne
+    "roi": None,  # domyślny wycinek [x, y, w, h] w pikselach dla /image/...?roi=1 i paneli
+}
+
+
+class CameraConfig(NamedTuple):
+    name: str
+    path: Path
+    good: frozenset
+    bad: frozenset = None
+    retention_days: float = 0
+    scan_interval: float = None
+    roi: tuple = None
+
+    def is_bad(self, category):
+        category = category.lower()
+        if self.bad is not None:
+            return category in self.bad
+        return category not in self.good
+
+
+def _categories(value, key, camera):
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = [value]
+    if not isinstance(value, list) or not all(isinstance(v, str) for v in value):
+        raise ValueError(f"Kamera {camera}: '{key}' musi być listą nazw kategorii")
+    return frozenset(v.lower() for v in value)
+
+
+def _number(value, key, camera):
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+        raise ValueError(f"Kamera {camera}: '{key}' musi być liczbą nieujemną")
+    return value
+
+
+def _roi(value, camera):
+    if value is None:
+        return None
+    if (not isinstance(value, list) or len(value) != 4
+            or not all(isinstance(v, int) and not isinstance(v, bool) for v in value)
+            or min(value[:2]) < 0 or min(value[2:]) <= 0):
+        raise ValueError(f"Kamera {camera}: 'roi' musi być listą [x, y, w, h] (w, h > 0)")
+    return tuple(value)
+
+
+def parse_registry(data):
+    """{nazwa: CameraConfig} z zawartości pliku; ValueError przy błędnym wpisie."""
+    defaults = dict(DEFAULTS)
+    defaults.update(data.get("defaults", {}))
+    cameras = {}
+    for name, entry in data.get("cameras", {}).items():
+        if not isinstance(entry, dict):
+            raise ValueError(f"Kamera {name}: oczekiwano tabeli [cameras.{name}]")
+        options = dict(defaults)
+        options.update(entry)
+        unknown = set(options) - set(DEFAULTS) - {"path"}
+        if unknown:
+            raise ValueError(f"Kamera {name}: nieznane opcje {', '.join(sorted(unknown))}")
+        if not options.get("path"):
+            raise ValueError(f"Kamera {name}: brak 'path'")
+        cameras[name] = CameraConfig(
+            name=name,
+            path=Path(options["path"]),
+            good=_categories(options["good"], "good", name) or frozenset(),
+            bad=_categories(options["bad"], "bad", name),
+            retention_days=_number(options["retention_days"], "retention_days", name) or 0,
+            scan_interval=_number(options["scan_interval"], "scan_interval", name),
+            roi=_roi(options["roi"], name),
+        )
+    return cameras
+
+
+def load_registry(path):
+    with open(path, "rb") as f:
+        try:
+            data = tomllib.load(f)
+        except tomllib.TOMLDecodeError as e:
+            raise ValueError(f"{path}: {e}") from None
+    return parse_registry(data)
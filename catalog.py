@@ -0,0 +1,230 @@
+# catalog.py - katalog historii inspekcji w SQLite (WAL) z zapytaniami po zakresie czasu
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+log = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    camera   TEXT NOT NULL,
+    category TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    mtime    REAL NOT NULL,
+    size     INTEGER NOT NULL,
+    path     TEXT NOT NULL,
+    PRIMARY KEY (camera, category, filename)
+);
+CREATE INDEX IF NOT EXISTS images_camera_mtime ON images (camera, mtime);
+CREATE INDEX IF NOT EXISTS images_camera_category_mtime ON images (camera, category, mtime);
+"""
+
+MAX_BATCH = 5000  # operacji w jednej transakcji zapisu
+
+
+class Catalog:
+    """Katalog wszystkich zdjęć zasilany przyrostowo przez listenery CameraIndex.
+
+    Zapisy idą przez jeden wątek (kolejka, zmiany łączone w transakcje),
+    odczyty korzystają z puli osobnych połączeń - w trybie WAL nie blokują się
+    nawzajem z zapisem.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connect()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+        self._writer_conn = conn
+        self._readers = queue.SimpleQueue()
+        self._ops = queue.Queue()
+        self._retention = {}  # kamera -> retencja w sekundach (brak = bez limitu)
+        self._writer = threading.Thread(target=self._write_loop, name="catalog", daemon=True)
+        self._writer.start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    # --- zasilanie z indeksu ---
+
+    def attach(self, index, retention_days=0):
+        """Zasilanie z indeksu; zdjęcia starsze niż `retention_days` nie trafiają do katalogu."""
+        if retention_days:
+            self._retention[index.camera] = retention_days * 86400
+            self.prune(index.camera, time.time() - retention_days * 86400)
+        else:
+            self._retention.pop(index.camera, None)
+        if self._on_change in index.listeners:
+            return
+        index.listeners.append(self._on_change)
+        # Po pierwszym pełnym skanie usuwamy wpisy plików skasowanych, gdy serwer nie działał
+        threading.Thread(target=self._reconcile_when_loaded, args=(index,),
+                         name=f"catalog-sync-{index.camera}", daemon=True).start()
+
+    def _on_change(self, index, added, removed):
+        base = str(index.base_dir)
+        retention = self._retention.get(index.camera)
+        if retention:
+            # Pełny skan po starcie lub przeładowaniu zgłasza wszystkie pliki z dysku,
+            # także te, które prune() już usunął z historii
+            cutoff = time.time() - retention
+            added = [r for r in added if r.mtime >= cutoff]
+        if added:
+            rows = [
+                (index.camera, r.category, r.name, r.mtime, r.size, os.path.join(base, r.category, r.name))
+                for r in added
+            ]
+            self._ops.put(("upsert", rows))
+        if removed:
+            self._ops.put(("delete", [(index.camera, r.category, r.name) for r in removed]))
+
+    def _reconcile_when_loaded(self, index):
+        index.loaded.wait()
+        present = [(r.category, r.name) for r in index.records()]
+        self._ops.put(("reconcile", (index.camera, present)))
+
+    def _write_loop(self):
+        conn = self._writer_conn
+        while True:
+            ops = [self._ops.get()]
+            while len(ops) < MAX_BATCH:
+                try:
+                    ops.append(self._ops.get_nowait())
+                except queue.Empty:
+                    break
+            if any(op is None for op in ops):
+                ops = [op for op in ops if op is not None]
+                stop = True
+            else:
+                stop = False
+            try:
+                conn.execute("BEGIN")
+                for kind, payload in ops:
+                    getattr(self, f"_write_{kind}")(conn, payload)
+                conn.execute("COMMIT")
+            except Exception:
+                # Wątek zapisu musi przetrwać błąd partii - inaczej historia przestaje
+                # się aktualizować, a flush() czeka w nieskończoność
+                log.exception("Błąd zapisu katalogu %s", self.path)
+                self._rollback(conn)
+            # flush() wraca dopiero po zatwierdzeniu (lub wycofaniu) partii
+            for kind, payload in ops:
+                if kind == "barrier":
+                    payload.set()
+            if stop:
+                return
+
+    def _rollback(self, conn):
+        # Przy SQLITE_FULL/IOERR na COMMIT SQLite sam wycofuje transakcję
+        if not conn.in_transaction:
+            return
+        try:
+            conn.execute("ROLLBACK")
+        except sqlite3.Error:
+            log.exception("Błąd wycofania zapisu katalogu %s", self.path)
+
+    def _write_upsert(self, conn, rows):
+        conn.executemany(
+            "INSERT OR REPLACE INTO images (camera, category, filename, mtime, size, path)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+
+    def _write_delete(self, conn, keys):
+        conn.executemany("DELETE FROM images WHERE camera = ? AND category = ? AND filename = ?", keys)
+
+    def _write_reconcile(self, conn, payload):
+        camera, present = payload
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS present (category TEXT, filename TEXT,"
+                     " PRIMARY KEY (category, filename))")
+        conn.execute("DELETE FROM present")
+        conn.executemany("INSERT OR IGNORE INTO present VALUES (?, ?)", present)
+        cur = conn.execute(
+            "DELETE FROM images WHERE camera = ? AND NOT EXISTS"
+            " (SELECT 1 FROM present p WHERE p.category = images.category AND p.filename = images.filename)",
+            (camera,),
+        )
+        if cur.rowcount:
+            log.info("Katalog: usunięto %d nieistniejących zdjęć kamery %s", cur.rowcount, camera)
+        conn.execute("DELETE FROM present")
+
+    def prune(self, camera, before):
+        """Usuwa wpisy kamery starsze niż `before` (retencja z rejestru kamer)."""
+        self._ops.put(("prune", (camera, before)))
+
+    def _write_prune(self, conn, payload):
+        cur = conn.execute("DELETE FROM images WHERE camera = ? AND mtime < ?", payload)
+        if cur.rowcount:
+            log.info("Katalog: usunięto %d wpisów kamery %s starszych niż retencja", cur.rowcount, payload[0])
+
+    def flush(self):
+        """Czeka, aż wszystkie dotychczasowe zmiany trafią do bazy."""
+        done = threading.Event()
+        self._ops.put(("barrier", done))
+        done.wait()
+
+    def _write_barrier(self, conn, done):
+        pass  # ustawiany w _write_loop po COMMIT
+
+    def close(self):
+        self._ops.put(None)
+        self._writer.join()
+        self._writer_conn.close()
+
+    # --- odczyty ---
+
+    def query(self, camera, start=None, end=None, categories=None, before=None, limit=100):
+        """Zdjęcia kamery od najnowszego, z zakresu [start, end).
+
+        `before` to kursor (mtime, nazwa) ostatniego wiersza poprzedniej strony.
+        Zwraca listę krotek (kategoria, nazwa, mtime, rozmiar).
+        """
+        sql = ["SELECT category, filename, mtime, size FROM images WHERE camera = ?"]
+        args = [camera]
+        if categories is not None:
+            sql.append(f"AND category IN ({','.join('?' * len(categories))})")
+            args.extend(categories)
+        if start is not None:
+            sql.append("AND mtime >= ?")
+            args.append(start)
+        if end is not None:
+            sql.append("AND mtime < ?")
+            args.append(end)
+        if before is not None:
+            sql.append("AND (mtime < ? OR (mtime = ? AND filename < ?))")
+            args.extend((before[0], before[0], before[1]))
+        sql.append("ORDER BY mtime DESC, filename DESC LIMIT ?")
+        args.append(limit)
+        return self._read(" ".join(sql), args)
+
+    def categories(self, camera):
+        """Kategorie, w których kamera ma zdjęcia w historii (także już usunięte z dysku)."""
+        # Skok po indeksie (camera, category, ...) zamiast DISTINCT po wszystkich wierszach
+        rows = self._read(
+            "WITH RECURSIVE c(category) AS ("
+            " SELECT MIN(category) FROM images WHERE camera = ?"
+            " UNION ALL"
+            " SELECT (SELECT MIN(category) FROM images WHERE camera = ? AND category > c.category)"
+            " FROM c WHERE c.category IS NOT NULL"
+            ") SELECT category FROM c WHERE category IS NOT NULL",
+            (camera, camera),
+        )
+        return [category for (category,) in rows]
+
+    def _read(self, sql, args):
+        try:
+            conn = self._readers.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            return conn.execute(sql, args).fetchall()
+        finally:
+            self._readers.put(conn)
@@ -0,0 +1,35 @@
+# gunicorn.conf.py - konfiguracja produkcyjna: gunicorn -c gunicorn.conf.py wsgi:app
+#
+# Model: mało procesów, dużo wątków (gthread). Odpowiedzi API są tanie (indeks
+# w pamięci, 304 bez JSON-a), a połączenia SSE (/api/stream) trzymają wątek przez
+# cały czas życia - liczba wątków musi pokryć liczbę ekranów + zapas na zwykłe
+# żądania. Jeden proces ma wszystkie cache i obserwatory "na ciepło"; kolejne
+# procesy (INSPEKCJA_WORKERS > 1) pracują w trybie odświeżania przy żądaniu.
+#
+# Pomiar (loadtest.py, 1 vCPU współdzielony z klientem testowym, 1 proces x 64 wątki,
+# 64 klientów keep-alive):
+#   /api/latest/X1 z If-None-Match (304)   ~1600 żądań/s, p50 37 ms, p99 81 ms
+#   /api/latest/X1 pełny JSON (200)        ~1150 żądań/s, p50 53 ms, p99 119 ms
+# 30 ekranów odpytujących co 2 s to ~15-30 żądań/s, czyli kilka procent tej wydajności.
+#
+# Rejestr kamer (cameras.toml) każdy proces przeładowuje sam po zmianie pliku.
+# SIGHUP wysłany do głównego procesu gunicorna restartuje procesy robocze (tracąc
+# cache) - do natychmiastowego przeładowania bez restartu służy POST /admin/reload
+# albo SIGHUP wysłany do procesu roboczego.
+import os
+
+bind = os.environ.get("INSPEKCJA_BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("INSPEKCJA_WORKERS", "1"))
+threads = int(os.environ.get("INSPEKCJA_THREADS", "64"))
+worker_class = "gthread"
+keepalive = 75  # dłużej niż keepalive_timeout nginx przed aplikacją
+timeout = 60
+graceful_timeout = 10
+# Bez preload: pule wątków i procesów tworzone są w procesie roboczym, po forku
+preload_app = False
+accesslog = os.environ.get("INSPEKCJA_ACCESS_LOG")  # np. "-" na stdout
+
+
+def post_worker_init(worker):
+    from wsgi import init_worker
+    init_worker()
@@ -0,0 +1,528 @@
+# image_index.py - indeks zdjęć kamer trzymany w pamięci
+import bisect
+import concurrent.futures
+import heapq
+import itertools
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import NamedTuple
+
+log = logging.getLogger(__name__)
+
+ALLOWED_EXTS = {".jpg", ".jpeg", ".png"}
+
+
+class Interner:
+    """Dwukierunkowe mapowanie nazw (kamer, kategorii) na małe liczby całkowite."""
+
+    def __init__(self):
+        self._ids = {}
+        self._names = []
+        self._lock = threading.Lock()
+
+    def id(self, name):
+        try:
+            return self._ids[name]
+        except KeyError:
+            with self._lock:
+                if name not in self._ids:
+                    self._ids[name] = len(self._names)
+                    self._names.append(name)
+                return self._ids[name]
+
+    def name(self, id_):
+        return self._names[id_]
+
+
+CAMERAS = Interner()
+CATEGORIES = Interner()
+
+
+class ImageRecord(NamedTuple):
+    """Jedno zdjęcie w indeksie - krotka bez __dict__, sortowana po mtime.
+
+    Kamera i kategoria są trzymane jako internowane identyfikatory; słownik
+    z adresem URL powstaje dopiero dla zdjęć, które trafiają do odpowiedzi.
+    """
+
+    mtime: float
+    camera_id: int
+    category_id: int
+    name: str
+    size: int = 0
+
+    @property
+    def camera(self):
+        return CAMERAS.name(self.camera_id)
+
+    @property
+    def category(self):
+        return CATEGORIES.name(self.category_id)
+
+
+def is_image_name(name):
+    dot = name.rfind(".")
+    return dot > 0 and name[dot:].lower() in ALLOWED_EXTS
+
+
+def scan_entries(directory):
+    """Generuje (mtime, nazwa, rozmiar) zdjęć z katalogu, po jednym stat() na plik.
+
+    Rozszerzenie sprawdzane jest przed stat(), a is_file() korzysta z typu
+    zwróconego przez readdir (d_type), więc obce pliki nie kosztują syscalla.
+    """
+    with os.scandir(directory) as it:
+        for entry in it:
+            if not is_image_name(entry.name):
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+                st = entry.stat()
+            except (FileNotFoundError, PermissionError):
+                continue
+            yield st.st_mtime, entry.name, st.st_size
+
+
+def scan_category(directory, camera_id=0, category_id=0):
+    """Zwraca {nazwa: ImageRecord} dla zdjęć w katalogu kategorii."""
+    return {
+        name: ImageRecord(mtime, camera_id, category_id, name, size)
+        for mtime, name, size in scan_entries(directory)
+    }
+
+
+def newest_files(directory, limit):
+    """`limit` najnowszych zdjęć katalogu bez sortowania całej listy."""
+    return heapq.nlargest(limit, scan_entries(directory))
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Wywołuje fn() co najwyżej raz naraz; równoległe wywołania czekają na ten sam wynik.
+
+    Wynik jest dodatkowo używany ponownie przez `max_age` sekund od zakończenia,
+    więc obciążenie zależy od liczby kamer, a nie liczby klientów.
+    """
+
+    def __init__(self, fn, max_age=0.0):
+        self.fn = fn
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._call = None
+        self._result = None
+        self._finished = None
+
+    def __call__(self):
+        with self._lock:
+            if self._finished is not None and time.monotonic() - self._finished < self.max_age:
+                return self._result
+            call = self._call
+            leader = call is None
+            if leader:
+                call = self._call = _Call()
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self.fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._call = None
+                if call.error is None:
+                    self._result = call.result
+                    self._finished = time.monotonic()
+            call.done.set()
+        return call.result
+
+
+class _Category:
+    __slots__ = ("files", "order")
+
+    def __init__(self, files=None):
+        self.files = dict(files or {})           # nazwa -> ImageRecord
+        self.order = sorted(self.files.values())  # te same rekordy, rosnąco po mtime
+
+    def add(self, record):
+        old = self.files.get(record.name)
+        if old == record:
+            return False
+        if old is not None:
+            self._discard(old)
+        self.files[record.name] = record
+        bisect.insort(self.order, record)
+        return True
+
+    def remove(self, name):
+        old = self.files.pop(name, None)
+        if old is None:
+            return None
+        self._discard(old)
+        return old
+
+    def _discard(self, record):
+        i = bisect.bisect_left(self.order, record)
+        if i < len(self.order) and self.order[i] == record:
+            del self.order[i]
+
+
+_MISSING = object()
+
+
+class _Probe:
+    """Sprawdzenie jednego katalogu kategorii zlecone do wspólnej puli skanów."""
+
+    __slots__ = ("seen", "future", "started", "started_wall", "warned")
+
+    def __init__(self, seen):
+        self.seen = seen  # mtime katalogu z ostatniego skanu, względem którego sprawdzamy
+        self.future = None
+        self.started = None  # time.monotonic() startu w wątku puli; None = czeka w kolejce
+        self.started_wall = None
+        self.warned = False
+
+
+class CameraIndex:
+    """Posortowany po mtime indeks zdjęć jednej kamery.
+
+    Budowany raz pełnym skanem, potem aktualizowany przyrostowo: refresh()
+    stat-uje tylko katalogi kategorii i przeskanowuje te, których mtime się
+    zmienił. Odczyty (latest/recent_bad) nie dotykają dysku.
+    """
+
+    def __init__(self, camera, base_dir, is_bad=None, freshness=0.0, executor=None, dir_timeout=None):
+        self.camera = camera
+        self.camera_id = CAMERAS.id(camera)
+        self.base_dir = Path(base_dir)
+        self.is_bad = is_bad or (lambda category: category.lower() != "good")
+        self.executor = executor  # wspólna pula wątków do równoległego listowania kategorii
+        self.dir_timeout = dir_timeout
+        self._refresh_lock = threading.Lock()
+        # Skan przy odczycie: jeden naraz, a wynik młodszy niż `freshness` s jest współdzielony
+        self._refresh_flight = SingleFlight(self.refresh, freshness)
+        self.generation = 0  # rośnie przy każdej zmianie zawartości
+        self.watched = False  # True, gdy obserwator (watcher.py) na bieżąco zasila indeks
+        self.loaded = threading.Event()  # ustawiane po pierwszym pełnym skanie
+        self._lock = threading.RLock()
+        self._categories = {}  # kategoria -> _Category
+        self._dir_mtimes = {}  # kategoria -> mtime katalogu z ostatniego skanu
+        self._probes = {}  # kategoria -> _Probe wciąż w toku (wolny lub zawieszony katalog)
+        self._scanned = False  # refresh() przeszedł już raz przez wszystkie katalogi
+        self._base_mtime = None
+        # Wywoływane po każdej zmianie jako listener(index, dodane, usunięte),
+        # obie listy zawierają ImageRecord
+        self.listeners = []
+
+    # --- aktualizacje ---
+
+    def _changed(self, added, removed):
+        self.generation += 1
+        for listener in self.listeners:
+            try:
+                listener(self, added, removed)
+            except Exception:
+                log.exception("Błąd listenera indeksu kamery %s", self.camera)
+
+    def record(self, category, name, mtime, size=0):
+        return ImageRecord(mtime, self.camera_id, CATEGORIES.id(category), name, size)
+
+    def add(self, category, name, mtime, size=0):
+        record = self.record(category, name, mtime, size)
+        with self._lock:
+            cat = self._categories.get(category)
+            if cat is None:
+                cat = self._categories[category] = _Category()
+            if not cat.add(record):
+                return False
+            self._changed([record], [])
+            return True
+
+    def remove(self, category, name):
+        with self._lock:
+            cat = self._categories.get(category)
+            record = cat.remove(name) if cat is not None else None
+            if record is None:
+                return False
+            self._changed([], [record])
+            return True
+
+    def replace_category(self, category, files):
+        """Podmienia zawartość kategorii na {nazwa: ImageRecord} z pełnego skanu."""
+        with self._lock:
+            cat = self._categories.get(category)
+            old = cat.files if cat is not None else {}
+            if cat is not None and old == files:
+                return False
+            self._categories[category] = _Category(files)
+            added = [r for n, r in files.items() if old.get(n) != r]
+            removed = [r for n, r in old.items() if n not in files]
+            self._changed(added, removed)
+            return True
+
+    def drop_category(self, category):
+        with self._lock:
+            self._dir_mtimes.pop(category, None)
+            cat = self._categories.pop(category, None)
+            if cat is None:
+                return False
+            self._changed([], list(cat.files.values()))
+            return True
+
+    def refresh(self):
+        """Synchronizuje indeks z dyskiem, skanując tylko zmienione katalogi.
+
+        Z `executor` katalogi kategorii są sprawdzane równolegle. Na katalog, który
+        nie odpowie w `dir_timeout` s od startu sprawdzania, refresh() nie czeka:
+        wynik trafi do indeksu, gdy sprawdzanie się zakończy, a do tego czasu kolejne
+        refresh() nie zlecają go ponownie. `loaded` jest ustawiane dopiero wtedy,
+        gdy wszystkie katalogi zostały odczytane.
+        """
+        with self._refresh_lock:
+            try:
+                base_mtime = self.base_dir.stat().st_mtime_ns
+            except (FileNotFoundError, NotADirectoryError, PermissionError):
+                with self._lock:
+                    for category in list(self._categories):
+                        self.drop_category(category)
+                    self._dir_mtimes.clear()
+                self._base_mtime = None
+                return
+
+            if base_mtime != self._base_mtime:
+                with os.scandir(self.base_dir) as it:
+                    present = {d.name for d in it if d.is_dir()}
+                with self._lock:
+                    for category in set(self._categories) - present:
+                        self.drop_category(category)
+                    for category in present:
+                        self._dir_mtimes.setdefault(category, None)
+                self._base_mtime = base_mtime
+
+            with self._lock:
+                pending = list(self._dir_mtimes.items())
+            if self.executor is None or (len(pending) < 2 and not self._probes):
+                results = [(category, seen, self._probe(category, seen)) for category, seen in pending]
+                with self._lock:
+                    for category, seen, result in results:
+                        self._apply(category, seen, result)
+            else:
+                self._wait_probes(self._submit_probes(pending))
+
+            with self._lock:
+                self._scanned = True
+                if not self._probes:
+                    self.loaded.set()
+
+    def _submit_probes(self, pending):
+        probes = []
+        with self._lock:
+            for category, seen in pending:
+                probe = self._probes.get(category)
+                if probe is None:  # katalog sprawdzany od poprzedniego refresh() nie jest zlecany ponownie
+                    probe = self._probes[category] = _Probe(seen)
+                    probe.future = self.executor.submit(self._run_probe, category, probe)
+                    probe.future.add_done_callback(lambda _f, c=category, p=probe: self._probe_done(c, p))
+                probes.append((category, probe))
+        return probes
+
+    def _run_probe(self, category, probe):
+        probe.started_wall = time.time()
+        probe.started = time.monotonic()
+        return self._probe(category, probe.seen)
+
+    def _wait_probes(self, probes):
+        # Limit liczony od startu sprawdzania w wątku puli; sonda, która przez `dir_timeout`
+        # nie wystartowała (wspólna pula zajęta), też nie wstrzymuje refresh()
+        waiting = {probe.future: (category, probe) for category, probe in probes}
+        queued_deadline = time.monotonic() + (self.dir_timeout or 0.0)
+        while waiting:
+            if self.dir_timeout is None:
+                remaining = None
+            else:
+                deadline = max(queued_deadline if p.started is None else p.started + self.dir_timeout
+                               for _c, p in waiting.values())
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+            done, _ = concurrent.futures.wait(waiting, timeout=remaining,
+                                              return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                category, probe = waiting.pop(future)
+                self._probe_done(category, probe)
+        for category, probe in waiting.values():
+            if not probe.warned:
+                probe.warned = True
+                log.warning("Katalog %s/%s nie odpowiedział w %.1f s - wynik zostanie użyty po zakończeniu",
+                            self.camera, category, self.dir_timeout)
+
+    def _probe_done(self, category, probe):
+        # Wywoływane z refresh() i z wątku puli po zakończeniu sondy; stosowane raz
+        with self._lock:
+            if self._probes.get(category) is not probe:
+                return
+            del self._probes[category]
+            try:
+                result = probe.future.result()
+            except Exception:
+                log.exception("Błąd skanowania katalogu %s/%s", self.camera, category)
+                result = None
+            if probe.warned:
+                log.info("Katalog %s/%s odpowiedział po przekroczeniu limitu", self.camera, category)
+            self._apply(category, probe.seen, result, probe.started_wall)
+            if self._scanned and not self._probes:
+                self.loaded.set()
+
+    def _apply(self, category, seen, result, started_wall=None):
+        # Pod self._lock. Wynik jest nieaktualny, jeśli w międzyczasie katalog przeskanowano
+        # ponownie (rescan_category) albo usunięto z indeksu.
+        if self._dir_mtimes.get(category, _MISSING) != seen or result is None:
+            return
+        if result is _MISSING:
+            self.drop_category(category)
+            return
+        mtime, files = result
+        cat = self._categories.get(category)
+        if cat is not None and started_wall is not None:
+            # Zdjęcia dodane przez obserwatora już w trakcie skanu wolnego katalogu
+            for name, record in cat.files.items():
+                if name not in files and record.mtime >= started_wall:
+                    files[name] = record
+        self.replace_category(category, files)
+        self._dir_mtimes[category] = mtime
+
+    def _probe(self, category, seen):
+        # Wynik: None = bez zmian lub błąd dostępu, _MISSING = katalog zniknął, (mtime, pliki)
+        directory = self.base_dir / category
+        try:
+            mtime = directory.stat().st_mtime_ns
+            if mtime == seen:
+                return None
+            return mtime, scan_category(directory, self.camera_id, CATEGORIES.id(category))
+        except (FileNotFoundError, NotADirectoryError):
+            return _MISSING
+        except PermissionError:
+            return None
+
+    def rescan_category(self, category):
+        directory = self.base_dir / category
+        mtime = directory.stat().st_mtime_ns
+        files = scan_category(directory, self.camera_id, CATEGORIES.id(category))
+        with self._lock:
+            self.replace_category(category, files)
+            self._dir_mtimes[category] = mtime
+
+    def ensure_current(self):
+        # Bez obserwatora indeks synchronizujemy przy odczycie
+        if not self.watched:
+            self._refresh_flight()
+
+    # --- odczyty ---
+
+    def latest(self):
+        """Najnowsze zdjęcie dowolnej kategorii (ImageRecord) albo None."""
+        with self._lock:
+            newest = [cat.order[-1] for cat in self._categories.values() if cat.order]
+            return max(newest) if newest else None
+
+    def recent_bad(self, limit):
+        """Do `limit` najnowszych zdjęć z kategorii wadliwych, od najnowszego."""
+        with self._lock:
+            streams = [
+                reversed(cat.order)
+                for category, cat in self._categories.items()
+                if self.is_bad(category)
+            ]
+            return list(itertools.islice(heapq.merge(*streams, reverse=True), limit))
+
+    def recent_good(self, limit):
+        """Do `limit` najnowszych zdjęć z kategorii OK, od najnowszego."""
+        with self._lock:
+            streams = [
+                reversed(cat.order)
+                for category, cat in self._categories.items()
+                if not self.is_bad(category)
+            ]
+            return list(itertools.islice(heapq.merge(*streams, reverse=True), limit))
+
+    def locked(self):
+        """Blokada indeksu: dopóki jest trzymana, zmiany (i listenery) czekają."""
+        return self._lock
+
+    def summary(self, bad_limit):
+        """(latest(), recent_bad(bad_limit)) odczytane atomowo, pod jedną blokadą."""
+        with self._lock:
+            return self.latest(), self.recent_bad(bad_limit)
+
+    def page(self, category, after=None, limit=100):
+        """Strona zdjęć kategorii od najnowszego, O(log N + limit).
+
+        `after` to kursor (mtime, nazwa) ostatniego zdjęcia poprzedniej strony.
+        """
+        with self._lock:
+            cat = self._categories.get(category)
+            if cat is None:
+                return []
+            end = len(cat.order)
+            if after is not None:
+                probe = ImageRecord(after[0], self.camera_id, CATEGORIES.id(category), after[1], -1)
+                end = bisect.bisect_left(cat.order, probe)
+            return cat.order[max(end - limit, 0):end][::-1]
+
+    def categories(self):
+        with self._lock:
+            return list(self._categories)
+
+    def records(self):
+        """Migawka wszystkich rekordów (do uzgadniania zewnętrznych katalogów, np. SQLite)."""
+        with self._lock:
+            return [r for cat in self._categories.values() for r in cat.files.values()]
+
+    def __len__(self):
+        with self._lock:
+            return sum(len(cat.files) for cat in self._categories.values())
+
+
+class ChangeNotifier:
+    """Budzi wątki czekające na zmianę dowolnego z podpiętych indeksów."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self.sequence = 0
+
+    def attach(self, index):
+        index.listeners.append(self._on_change)
+
+    def detach(self, index):
+        if self._on_change in index.listeners:
+            index.listeners.remove(self._on_change)
+
+    def _on_change(self, index, added, removed):
+        self.notify()
+
+    def notify(self):
+        with self._cond:
+            self.sequence += 1
+            self._cond.notify_all()
+
+    def wait(self, seen, timeout):
+        """Czeka, aż sequence przekroczy `seen`; zwraca bieżącą wartość."""
+        with self._cond:
+            self._cond.wait_for(lambda: self.sequence != seen, timeout)
+            return self.sequence
@@ -0,0 +1,67 @@
+# loadtest.py - prosty test obciążenia /api/latest (wiele ekranów odpytujących serwer)
+#
+#   python loadtest.py --url http://127.0.0.1:8000/api/latest/X1 --clients 64 --seconds 10
+#
+# Każdy klient trzyma własne połączenie keep-alive; z --etag wysyła If-None-Match
+# jak przeglądarka (odpowiedzi 304).
+import argparse
+import http.client
+import statistics
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+def client(url, use_etag, deadline, latencies, errors):
+    parts = urlsplit(url)
+    path = parts.path + (f"?{parts.query}" if parts.query else "")
+    conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+    etag = None
+    while time.perf_counter() < deadline:
+        headers = {"If-None-Match": etag} if use_etag and etag else {}
+        start = time.perf_counter()
+        try:
+            conn.request("GET", path, headers=headers)
+            resp = conn.getresponse()
+            resp.read()
+        except (OSError, http.client.HTTPException):
+            errors.append(1)
+            conn.close()
+            conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=30)
+            continue
+        latencies.append(time.perf_counter() - start)
+        if resp.status >= 400:
+            errors.append(1)
+        etag = resp.getheader("ETag") or etag
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--url", default="http://127.0.0.1:8000/api/latest/X1")
+    parser.add_argument("--clients", type=int, default=64)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--etag", action="store_true", help="wysyłaj If-None-Match")
+    args = parser.parse_args()
+
+    latencies, errors = [], []
+    deadline = time.perf_counter() + args.seconds
+    threads = [
+        threading.Thread(target=client, args=(args.url, args.etag, deadline, latencies, errors))
+        for _ in range(args.clients)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    if not latencies:
+        print("Brak odpowiedzi")
+        return
+    q = statistics.quantiles(latencies, n=100)
+    print(f"{len(latencies)} żądań w {args.seconds:.0f} s: {len(latencies) / args.seconds:.0f} żądań/s, "
+          f"p50 {q[49] * 1000:.1f} ms, p99 {q[98] * 1000:.1f} ms, błędów {len(errors)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,30 +1,69 @@
-from flask import Flask, render_template
+from flask import Flask, stream_template
+import itertools
 import os
 
+from image_index import is_image_name
+
 app = Flask(__name__)
 
 # Ścieżka bazowa do zdjęć w symlinkowanym katalogu
 BASE_IMAGE_DIR = '/ftp/ftp/X1/new_images'
 
-@app.route('/')
-def index():
-    grouped_images = {}
+def walk_images(root):
+    # Leniwe przejście drzewa: (katalog, generator nazw zdjęć). Katalog jest czytany
+    # dopiero w trakcie renderowania, więc pamięć nie rośnie z liczbą plików.
+    subdirs = []
+
+    def files():
+        # Jak os.walk: katalog, którego nie da się odczytać (brak, usunięty w trakcie,
+        # bez uprawnień), jest pomijany - odpowiedź 200 już poszła, więc nie przerywamy strony
+        try:
+            it = os.scandir(root)
+        except OSError:
+            return
+        with it:
+            while True:
+                try:
+                    entry = next(it)
+                except StopIteration:
+                    break
+                except OSError:
+                    return
+                # Pomijamy ukryte pliki i wszystko, co nie jest zdjęciem
+                if entry.name.startswith('.'):
+                    continue
+                try:
+                    # Jak os.walk bez followlinks: dowiązanie do katalogu nad nim zapętliłoby przejście
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    subdirs.append(entry.path)
+                elif is_image_name(entry.name):
+                    yield entry.name
 
-    for root, dirs, files in os.walk(BASE_IMAGE_DIR):
-        # Pomijamy ukryte pliki
-        files = [f for f in files if not f.startswith('.')]
-        if not files:
-            continue
+    names = files()
+    first = next(names, None)
+    if first is not None:
+        yield root, itertools.chain((first,), names)
+    # Podkatalogi znane są dopiero po przeczytaniu całego katalogu
+    for subdir in subdirs:
+        yield from walk_images(subdir)
 
+
+def iter_grouped_images(base_dir):
+    for root, files in walk_images(base_dir):
         # Kategoria = podkatalog względem BASE_IMAGE_DIR (np. 'zgrzew', 'good', 'bad1')
-        category = os.path.relpath(root, BASE_IMAGE_DIR)
+        category = os.path.relpath(root, base_dir)
 
         # Ścieżki względem katalogu 'img' (bo symlink: static/img → /ftp/ftp/X1)
-        images = [os.path.join('new_images', category, f) for f in sorted(files)]
+        yield category, (os.path.join('new_images', category, f) for f in files)
 
-        grouped_images[category] = images
 
-    return render_template('index.html', grouped_images=grouped_images)
+@app.route('/')
+def index():
+    # stream_template wysyła HTML kategoria po kategorii, zanim kolejne zostaną wylistowane
+    return stream_template('browse.html', grouped_images=iter_grouped_images(BASE_IMAGE_DIR))
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=8000, debug=True)
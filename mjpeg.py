@@ -0,0 +1,93 @@
+# mjpeg.py - najnowsza klatka kamery jako strumień multipart/x-mixed-replace (MJPEG)
+import io
+import logging
+import threading
+from typing import NamedTuple
+
+from PIL import Image
+
+from thumbs import FORMATS
+
+log = logging.getLogger(__name__)
+
+BOUNDARY = "frame"
+MIMETYPE = f"multipart/x-mixed-replace; boundary={BOUNDARY}"
+# Dozwolone szerokości ?w= (ogranicza liczbę kodowanych wariantów)
+FRAME_WIDTHS = (320, 640, 960, 1280, 1920)
+
+
+class Frame(NamedTuple):
+    key: tuple  # (kategoria, nazwa, mtime) zdjęcia źródłowego
+    data: bytes
+
+
+def snap_frame_width(width):
+    """Najbliższa szerokość z FRAME_WIDTHS nie mniejsza niż żądana; None = oryginał."""
+    if not width:
+        return None
+    for w in FRAME_WIDTHS:
+        if width <= w:
+            return w
+    return None
+
+
+def encode_frame(src, width=None):
+    """JPEG klatki: oryginalny plik bez ponownego kodowania albo przeskalowany."""
+    if width is None and src.lower().endswith((".jpg", ".jpeg")):
+        with open(src, "rb") as f:
+            return f.read()
+    with Image.open(src) as img:
+        if width:
+            img.draft("RGB", (width, width * img.height // max(img.width, 1)))
+        img = img.convert("RGB")
+        if width and img.width > width:
+            img.thumbnail((width, img.height), Image.Resampling.LANCZOS)
+        out = io.BytesIO()
+        img.save(out, "JPEG", **FORMATS["jpeg"][2])
+        return out.getvalue()
+
+
+def multipart_part(data):
+    return b"--%s\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n%s\r\n" % (
+        BOUNDARY.encode(), len(data), data)
+
+
+class FrameHub:
+    """Ostatnia zakodowana klatka dla każdej pary (kamera, szerokość).
+
+    Klatka jest kodowana raz, przez pierwszego odbiorcę, który zauważy nowe
+    zdjęcie; pozostali dostają ten sam obiekt. Odbiorca pamięta tylko ostatnio
+    wysłaną klatkę (kolejka o pojemności 1), więc wolny klient po zakończeniu
+    wysyłki dostaje od razu najnowszą, a klatki pośrednie przepadają.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._frames = {}  # (kamera, szerokość) -> Frame
+        self._encoding = {}  # (kamera, szerokość) -> Lock kodowania
+
+    def cached(self, camera, width, key):
+        frame = self._frames.get((camera, width))
+        return frame if frame is not None and frame.key == key else None
+
+    def frame(self, camera, width, src, key):
+        """Klatka dla zdjęcia `key`; przy błędzie odczytu poprzednia klatka (lub None)."""
+        feed = (camera, width)
+        frame = self.cached(camera, width, key)
+        if frame is not None:
+            return frame
+        with self._lock:
+            lock = self._encoding.setdefault(feed, threading.Lock())
+        with lock:
+            frame = self.cached(camera, width, key)
+            if frame is not None:
+                return frame
+            try:
+                frame = Frame(key, encode_frame(src, width))
+            except FileNotFoundError:
+                return self._frames.get(feed)  # plik usunięty - zostaje poprzednia klatka
+            except (OSError, Image.DecompressionBombError):
+                log.exception("Nie można zakodować klatki %s", src)
+                return self._frames.get(feed)
+            self._frames[feed] = frame
+            return frame
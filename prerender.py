@@ -0,0 +1,186 @@
+# prerender.py - miniatury nowych wadliwych zdjęć renderowane w tle, zanim trafią do API
+import heapq
+import logging
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from thumbs import render_variants
+
+log = logging.getLogger(__name__)
+
+
+class _Job:
+    __slots__ = ("camera", "src", "seq", "on_done")
+
+    def __init__(self, camera, src, seq, on_done):
+        self.camera = camera
+        self.src = src
+        self.seq = seq
+        self.on_done = on_done
+
+
+class Prerenderer:
+    """Pula procesów renderująca miniatury (i opcjonalnie podgląd) nowych zdjęć NOK.
+
+    Kolejka oczekujących zadań jest ograniczona: przy przepełnieniu najstarsze
+    zadanie jest porzucane (jego miniatura powstanie leniwie przy pierwszym
+    żądaniu). Zadania dla zdjęć, które zanim doczekały się renderowania zostały
+    wyparte z listy ostatnich `keep_recent` wadliwych, są pomijane. Po awarii
+    procesu roboczego (np. OOM killer przy dużej klatce) pula jest tworzona od nowa.
+    """
+
+    def __init__(self, thumb_cache, variants, workers=2, max_pending=32, keep_recent=10):
+        self.thumb_cache = thumb_cache
+        self.variants = list(variants)  # [(szerokość, format)]
+        self.keep_recent = keep_recent
+        self._workers = workers
+        self._pool = self._new_pool()
+        self._slots = threading.Semaphore(workers)  # zadania w toku
+        self._pending = deque()
+        self._max_pending = max_pending
+        self._cond = threading.Condition()
+        self._arrivals = {}  # kamera -> licznik nowych zdjęć NOK
+        self._done = OrderedDict()  # (src, mtime_ns) ostatnio wyrenderowanych
+        self._local = threading.local()
+        self._closed = False
+        self._dispatcher = threading.Thread(target=self._dispatch, name="prerender", daemon=True)
+        self._dispatcher.start()
+
+    def _new_pool(self):
+        return ProcessPoolExecutor(self._workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def _replace_pool(self, broken):
+        # Zadania w toku dostają BrokenProcessPool naraz - pulę wymienia tylko pierwsze
+        with self._cond:
+            if self._pool is not broken or self._closed:
+                return
+            log.warning("Pula renderowania miniatur uszkodzona - tworzę nową")
+            self._pool = self._new_pool()
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    # --- wejścia ---
+
+    def arrival(self, index, category, name, mtime, size=0):
+        """Hook dla obserwatora: zdjęcie NOK trafia do indeksu dopiero z gotową miniaturą."""
+        if not index.is_bad(category):
+            index.add(category, name, mtime, size)
+            return
+        src = os.path.join(str(index.base_dir), category, name)
+
+        def publish():
+            if os.path.exists(src):  # plik mógł zostać usunięty w trakcie renderowania
+                index.add(category, name, mtime, size)
+
+        self.submit(index.camera, src, on_done=publish)
+
+    def attach(self, index):
+        # Zdjęcia wykryte skanem (polling, przepełnienie inotify) - tylko najnowsze
+        index.listeners.append(self._on_change)
+
+    def _on_change(self, index, added, removed):
+        if getattr(self._local, "publishing", False):
+            return  # zdjęcie z arrival() - miniatura już gotowa
+        bad = (r for r in added if index.is_bad(r.category))
+        for record in heapq.nlargest(self.keep_recent, bad):
+            self.submit(index.camera, os.path.join(str(index.base_dir), record.category, record.name))
+
+    def submit(self, camera, src, on_done=None):
+        with self._cond:
+            seq = self._arrivals[camera] = self._arrivals.get(camera, 0) + 1
+            if self._closed:
+                dropped = [_Job(camera, src, seq, on_done)]
+            else:
+                self._pending.append(_Job(camera, src, seq, on_done))
+                dropped = []
+                while len(self._pending) > self._max_pending:
+                    dropped.append(self._pending.popleft())
+                self._cond.notify()
+        for job in dropped:
+            log.warning("Kolejka miniatur pełna - pomijam %s", job.src)
+            self._finish(job)
+
+    # --- przetwarzanie ---
+
+    def _dispatch(self):
+        while True:
+            self._slots.acquire()
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._closed)
+                if not self._pending:
+                    self._slots.release()
+                    return
+                job = self._pending.popleft()
+                superseded = self._arrivals[job.camera] - job.seq >= self.keep_recent
+            work = None if superseded else self._missing_variants(job.src)
+            if not work:
+                self._slots.release()
+                self._finish(job)
+                continue
+            st, variants = work
+            pool = self._pool
+            try:
+                try:
+                    future = pool.submit(render_variants, job.src, variants)
+                except BrokenProcessPool:
+                    self._replace_pool(pool)
+                    pool = self._pool
+                    future = pool.submit(render_variants, job.src, variants)
+            except RuntimeError:  # pula zamknięta lub ponownie uszkodzona
+                log.exception("Nie można zlecić miniatury %s", job.src)
+                self._slots.release()
+                self._finish(job)
+                continue
+            future.add_done_callback(
+                lambda f, job=job, st=st, variants=variants, pool=pool: self._rendered(f, job, st, variants, pool))
+
+    def _missing_variants(self, src):
+        try:
+            st = os.stat(src)
+        except FileNotFoundError:
+            return None
+        with self._cond:
+            if (src, st.st_mtime_ns) in self._done:
+                return None
+        variants = [v for v in self.variants if not self.thumb_cache.contains(src, st, *v)]
+        return (st, variants) if variants else None
+
+    def _rendered(self, future, job, st, variants, pool):
+        self._slots.release()
+        try:
+            for (width, fmt), data in zip(variants, future.result()):
+                self.thumb_cache.store(job.src, st, width, fmt, data)
+            with self._cond:
+                self._done[(job.src, st.st_mtime_ns)] = True
+                while len(self._done) > 4 * self.keep_recent:
+                    self._done.popitem(last=False)
+        except FileNotFoundError:
+            pass  # plik usunięty, zanim doczekał się renderowania
+        except BrokenProcessPool:
+            # Bez ponowienia - to zdjęcie mogło być przyczyną awarii; miniatura powstanie przy żądaniu
+            log.error("Proces renderujący miniaturę %s zakończył się awaryjnie", job.src)
+            self._replace_pool(pool)
+        except Exception:
+            log.exception("Błąd renderowania miniatury %s", job.src)
+        self._finish(job)
+
+    def _finish(self, job):
+        if job.on_done is None:
+            return
+        self._local.publishing = True
+        try:
+            job.on_done()
+        except Exception:
+            log.exception("Błąd publikacji zdjęcia %s", job.src)
+        finally:
+            self._local.publishing = False
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._dispatcher.join()
+        self._pool.shutdown(wait=True)
@@ -0,0 +1,209 @@
+# recent.py - trwały bufor ostatnich zdjęć NOK każdej kamery, wspólny dla procesów serwera
+import heapq
+import json
+import logging
+import sqlite3
+import threading
+from pathlib import Path
+from typing import NamedTuple
+
+from image_index import CAMERAS, CATEGORIES, ImageRecord
+
+log = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS recent (
+    camera  TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    state   TEXT NOT NULL
+);
+"""
+
+
+class Snapshot(NamedTuple):
+    """Zapisany stan kamery: najnowsze zdjęcie i ostatnie NOK (od najnowszego)."""
+
+    version: int
+    latest: ImageRecord
+    bad: list
+
+
+class RecentStore:
+    """Bufor `limit` ostatnich zdjęć NOK i najnowszego zdjęcia każdej kamery w SQLite.
+
+    Proces z obserwatorami aktualizuje go przyrostowo z listenerów indeksu
+    (zapis w osobnym wątku, seria zmian łączona w jeden zapis); wersję stanu nadaje
+    od razu w pamięci (version()), zapis tylko ją utrwala. Pozostałe procesy
+    serwera oraz proces po restarcie, zanim zbuduje indeks, czytają stan stąd
+    zamiast skanować katalogi.
+    """
+
+    def __init__(self, path, limit):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.limit = limit
+        self._writer_conn = self._connect()
+        self._writer_conn.execute("PRAGMA journal_mode=WAL")
+        self._writer_conn.executescript(SCHEMA)
+        self._reader_conn = self._connect()
+        self._read_lock = threading.Lock()
+        self._data_version = None
+        self._snapshots = {}  # kamera -> Snapshot z ostatniego odczytu
+        self._lock = threading.Lock()
+        self._state = {}  # kamera -> (latest, bad) utrzymywane przyrostowo
+        self._versions = {}  # kamera -> wersja stanu z _state
+        self._pending = {}  # kamera -> (wersja, stan) czekające na zapis
+        # Wywoływane jako listener(kamera) po ustawieniu stanu kamery z pełnego indeksu
+        self.listeners = []
+        self._wake = threading.Condition(self._lock)
+        self._closed = False
+        self._writer = threading.Thread(target=self._write_loop, name="recent", daemon=True)
+        self._writer.start()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    # --- zasilanie z indeksu ---
+
+    def attach(self, index):
+        if self._on_change in index.listeners:
+            return
+        # Przed pozostałymi listenerami (ChangeNotifier): obudzone wątki widzą już nową wersję
+        index.listeners.insert(0, self._on_change)
+        threading.Thread(target=self._init_when_loaded, args=(index,),
+                         name=f"recent-sync-{index.camera}", daemon=True).start()
+
+    def _init_when_loaded(self, index):
+        # Częściowo zbudowany indeks nadpisałby dobry zapis z poprzedniego uruchomienia
+        index.loaded.wait()
+        # Listener pomija kamerę bez stanu, więc odczyt i ustawienie stanu muszą być atomowe
+        # względem zmian indeksu - inaczej zmiana pomiędzy nimi przepadłaby na stałe
+        with index.locked():
+            state = index.summary(self.limit)
+            with self._lock:
+                self._set(index.camera, state)
+        # Stan z indeksu mógł się różnić od zapisu z poprzedniego uruchomienia
+        for listener in self.listeners:
+            try:
+                listener(index.camera)
+            except Exception:
+                log.exception("Błąd listenera bufora NOK kamery %s", index.camera)
+
+    def _on_change(self, index, added, removed):
+        with self._lock:
+            state = self._state.get(index.camera)
+            if state is None:
+                return
+            state = self._update(index, state, added, removed)
+            if state != self._state[index.camera]:
+                self._set(index.camera, state)
+
+    def _update(self, index, state, added, removed):
+        latest, bad = state
+        shown = {(r.category_id, r.name) for r in bad}
+        if latest is not None:
+            shown.add((latest.category_id, latest.name))
+        # Usunięte lub nadpisane zdjęcie z bufora - odbudowa z indeksu (wywołanie pod jego blokadą)
+        if any((r.category_id, r.name) in shown for r in removed) or \
+                any((r.category_id, r.name) in shown for r in added):
+            return index.summary(self.limit)
+        if added:
+            newest = max(added)
+            if latest is None or newest > latest:
+                latest = newest
+            new_bad = [r for r in added if index.is_bad(r.category)]
+            if new_bad:
+                bad = heapq.nlargest(self.limit, bad + new_bad)
+        return latest, bad
+
+    def _set(self, camera, state):
+        version = self._versions.get(camera)
+        if version is None:
+            # Pierwszy stan kamery w tym procesie - kontynuacja wersji z zapisu
+            with self._read_lock:
+                row = self._reader_conn.execute("SELECT version FROM recent WHERE camera = ?",
+                                                (camera,)).fetchone()
+            version = row[0] if row else 0
+        self._versions[camera] = version + 1
+        self._state[camera] = state
+        self._pending[camera] = (version + 1, state)
+        self._wake.notify()
+
+    def version(self, camera):
+        """Wersja stanu utrzymywanego przez ten proces albo None, gdy nie prowadzi kamery."""
+        with self._lock:
+            return self._versions.get(camera)
+
+    def _write_loop(self):
+        while True:
+            with self._lock:
+                self._wake.wait_for(lambda: self._pending or self._closed)
+                pending, self._pending = self._pending, {}
+                if not pending and self._closed:
+                    return
+            try:
+                self._write(pending)
+            except sqlite3.Error:
+                log.exception("Błąd zapisu bufora NOK %s", self.path)
+
+    def _write(self, pending):
+        conn = self._writer_conn
+        conn.execute("BEGIN")
+        try:
+            for camera, (version, (latest, bad)) in pending.items():
+                state = json.dumps({
+                    "latest": _encode(latest),
+                    "bad": [_encode(r) for r in bad],
+                }, separators=(",", ":"))
+                conn.execute(
+                    "INSERT INTO recent (camera, version, state) VALUES (?, ?, ?)"
+                    " ON CONFLICT (camera) DO UPDATE SET version = excluded.version, state = excluded.state",
+                    (camera, version, state),
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._wake.notify()
+        self._writer.join()
+        self._writer_conn.close()
+        self._reader_conn.close()
+
+    # --- odczyty ---
+
+    def get(self, camera):
+        """Snapshot kamery albo None, gdy stan nie był jeszcze zapisany."""
+        with self._read_lock:
+            # data_version zmienia się po zapisie z innego połączenia - inaczej dane z pamięci
+            data_version = self._reader_conn.execute("PRAGMA data_version").fetchone()[0]
+            if data_version != self._data_version:
+                self._data_version = data_version
+                self._snapshots = {
+                    cam: self._decode(cam, version, state)
+                    for cam, version, state in self._reader_conn.execute("SELECT camera, version, state FROM recent")
+                }
+            return self._snapshots.get(camera)
+
+    def _decode(self, camera, version, state):
+        state = json.loads(state)
+        camera_id = CAMERAS.id(camera)
+
+        def record(item):
+            category, name, mtime, size = item
+            return ImageRecord(mtime, camera_id, CATEGORIES.id(category), name, size)
+
+        latest = record(state["latest"]) if state["latest"] else None
+        return Snapshot(version, latest, [record(item) for item in state["bad"][:self.limit]])
+
+
+def _encode(record):
+    if record is None:
+        return None
+    return [record.category, record.name, record.mtime, record.size]
@@ -0,0 +1,94 @@
+# regions.py - wycinki (ROI) i przeskalowania zdjęć liczone na serwerze, z cache w pamięci
+import io
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+from thumbs import FORMATS
+
+MIN_WIDTH = 16
+MAX_WIDTH = 4096
+
+
+def parse_box(value):
+    """"x,y,w,h" w pikselach oryginału -> krotka; ValueError przy błędnym zapisie."""
+    parts = value.split(",")
+    if len(parts) != 4:
+        raise ValueError("crop musi mieć postać x,y,w,h")
+    x, y, w, h = (int(p) for p in parts)
+    if x < 0 or y < 0 or w <= 0 or h <= 0:
+        raise ValueError("crop: x, y >= 0 oraz w, h > 0")
+    return x, y, w, h
+
+
+def render_region(src, box=None, width=None):
+    """JPEG wycinka `box` (cały obraz, gdy None) o szerokości co najwyżej `width`.
+
+    Przy zmniejszeniu JPEG jest dekodowany od razu w skali 1/2, 1/4 lub 1/8
+    (Image.draft), więc wycinek z 20 MP klatki nie wymaga pełnego dekodowania.
+    """
+    with Image.open(src) as img:
+        full_w, full_h = img.size
+        x, y, w, h = box or (0, 0, full_w, full_h)
+        x, y = min(x, full_w - 1), min(y, full_h - 1)
+        w, h = min(w, full_w - x), min(h, full_h - y)
+        out_w = min(width or w, w)
+        out_h = max(round(h * out_w / w), 1)
+        scale = out_w / w
+        img.draft("RGB", (max(int(full_w * scale), 1), max(int(full_h * scale), 1)))
+        f = img.width / full_w  # skala faktycznie zdekodowanego obrazu
+        region = img.crop((int(x * f), int(y * f), int((x + w) * f), int((y + h) * f)))
+    if region.size != (out_w, out_h):
+        region = region.resize((out_w, out_h), Image.Resampling.LANCZOS)
+    out = io.BytesIO()
+    region.convert("RGB").save(out, "JPEG", **FORMATS["jpeg"][2])
+    return out.getvalue()
+
+
+class MemoryLRU:
+    """Słownik bajtów o ograniczonym łącznym rozmiarze, usuwający najdawniej używane."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._total = 0
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is not None:
+                self._entries.move_to_end(key)
+            return data
+
+    def put(self, key, data):
+        if len(data) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            self._total += len(data) - (len(old) if old is not None else 0)
+            self._entries[key] = data
+            while self._total > self.max_bytes:
+                _key, evicted = self._entries.popitem(last=False)
+                self._total -= len(evicted)
+
+
+class RegionCache:
+    """Wycinki kluczowane tożsamością pliku (inode, rozmiar, mtime) i parametrami."""
+
+    def __init__(self, max_bytes):
+        self.cache = MemoryLRU(max_bytes)
+
+    def get_or_create(self, src, box=None, width=None):
+        """(bajty JPEG, ETag) wycinka; FileNotFoundError, gdy pliku już nie ma."""
+        st = os.stat(src)
+        box_id = ".".join(map(str, box)) if box else "full"
+        etag = f"{st.st_ino:x}-{st.st_size:x}-{st.st_mtime_ns:x}-{box_id}-{width or 0}"
+        key = (src, etag)
+        data = self.cache.get(key)
+        if data is None:
+            data = render_region(src, box, width)
+            self.cache.put(key, data)
+        return data, etag
@@ -0,0 +1,193 @@
+# thumbs.py - miniatury zdjęć generowane raz i trzymane w dyskowym cache LRU
+import hashlib
+import io
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+from PIL import Image
+
+log = logging.getLogger(__name__)
+
+THUMB_WIDTHS = (120, 240, 480, 960)
+DEFAULT_THUMB_WIDTH = 240
+# Co ile s put() uzgadnia listę plików cache z katalogiem (pliki innych procesów serwera)
+CACHE_SYNC_INTERVAL = 30.0
+
+FORMATS = {
+    # format -> (rozszerzenie, mimetype, parametry zapisu)
+    "jpeg": (".jpg", "image/jpeg", {"quality": 80, "optimize": True}),
+    "webp": (".webp", "image/webp", {"quality": 75, "method": 4}),
+}
+
+
+def snap_width(width):
+    """Zaokrągla żądaną szerokość w górę do jednego z THUMB_WIDTHS (ogranicza liczbę wariantów)."""
+    for w in THUMB_WIDTHS:
+        if width <= w:
+            return w
+    return THUMB_WIDTHS[-1]
+
+
+def render_thumbnail(src, width, fmt="jpeg"):
+    """Zwraca bajty miniatury o szerokości `width` w formacie `fmt`."""
+    return render_variants(src, [(width, fmt)])[0]
+
+
+def render_variants(src, variants):
+    """Renderuje kilka wariantów [(szerokość, format)] z jednego dekodowania źródła."""
+    widest = max(width for width, _fmt in variants)
+    with Image.open(src) as img:
+        # JPEG dekodowany od razu w zmniejszonej skali (1/2, 1/4, 1/8)
+        img.draft("RGB", (widest, widest * img.height // max(img.width, 1)))
+        img = img.convert("RGB")
+        results = []
+        for width, fmt in variants:
+            _ext, _mimetype, params = FORMATS[fmt]
+            scaled = img
+            if img.width > width:
+                scaled = img.copy()
+                scaled.thumbnail((width, img.height), Image.Resampling.LANCZOS)
+            out = io.BytesIO()
+            scaled.save(out, fmt.upper(), **params)
+            results.append(out.getvalue())
+        return results
+
+
+class DiskLRUCache:
+    """Katalog plików o ograniczonym łącznym rozmiarze, usuwający najdawniej używane.
+
+    Katalog może być wspólny dla kilku procesów serwera: get() przejmuje pliki
+    zapisane przez inny proces, a put() co CACHE_SYNC_INTERVAL s uzgadnia listę
+    z katalogiem, więc limit obejmuje pliki wszystkich procesów.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # nazwa pliku -> rozmiar, od najdawniej używanego
+        self._total = 0
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._load()
+        self._synced = time.monotonic()
+
+    def _load(self):
+        existing = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.startswith("."):
+                st = entry.stat()
+                existing.append((st.st_atime, entry.name, st.st_size))
+        for _atime, name, size in sorted(existing):
+            self._entries[name] = size
+            self._total += size
+        self._evict()
+
+    def get(self, name):
+        """Ścieżka do pliku z cache albo None."""
+        path = self.directory / name
+        with self._lock:
+            known = name in self._entries
+            if known:
+                self._entries.move_to_end(name)
+        if not known:
+            return self._adopt(name, path)
+        if not path.exists():
+            # Usunięty z zewnątrz (np. przez inny proces)
+            with self._lock:
+                self._total -= self._entries.pop(name, 0)
+            return None
+        return path
+
+    def _adopt(self, name, path):
+        # Plik zapisany przez inny proces (np. miniatura wyrenderowana przez właściciela)
+        try:
+            size = path.stat().st_size
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            if name not in self._entries:
+                self._entries[name] = size
+                self._total += size
+                self._evict()
+        return path
+
+    def put(self, name, data):
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, self.directory / name)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+        with self._lock:
+            self._total += len(data) - self._entries.pop(name, 0)
+            self._entries[name] = len(data)
+            self._evict()
+        self._sync()
+        return self.directory / name
+
+    def _sync(self):
+        # Bez tego każdy proces pilnuje limitu tylko dla swoich plików i wspólny
+        # katalog rośnie do liczba_procesów x max_bytes
+        now = time.monotonic()
+        with self._lock:
+            if now - self._synced < CACHE_SYNC_INTERVAL:
+                return
+            self._synced = now
+        on_disk = {}
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.startswith("."):
+                try:
+                    on_disk[entry.name] = entry.stat().st_size
+                except FileNotFoundError:
+                    pass
+        with self._lock:
+            for name in [n for n in self._entries if n not in on_disk]:
+                self._total -= self._entries.pop(name)
+            # Cudze pliki jako ostatnio użyte: trafiają tu wkrótce po zapisaniu
+            for name, size in on_disk.items():
+                if name not in self._entries:
+                    self._entries[name] = size
+                    self._total += size
+            self._evict()
+
+    def _evict(self):
+        while self._total > self.max_bytes and self._entries:
+            name, size = self._entries.popitem(last=False)
+            self._total -= size
+            try:
+                os.unlink(self.directory / name)
+            except FileNotFoundError:
+                pass
+
+
+class ThumbnailCache:
+    """Miniatury kluczowane ścieżką + mtime + rozmiarem źródła, szerokością i formatem."""
+
+    def __init__(self, directory, max_bytes):
+        self.cache = DiskLRUCache(directory, max_bytes)
+
+    def key(self, src, st, width, fmt):
+        ident = f"{src}|{st.st_mtime_ns}|{st.st_size}|{width}".encode()
+        return hashlib.sha1(ident).hexdigest() + FORMATS[fmt][0]
+
+    def contains(self, src, st, width, fmt):
+        return self.cache.get(self.key(src, st, width, fmt)) is not None
+
+    def store(self, src, st, width, fmt, data):
+        return self.cache.put(self.key(src, st, width, fmt), data)
+
+    def get_or_create(self, src, width, fmt="jpeg"):
+        st = os.stat(src)
+        name = self.key(src, st, width, fmt)
+        path = self.cache.get(name)
+        if path is None:
+            path = self.cache.put(name, render_thumbnail(src, width, fmt))
+        return path
@@ -0,0 +1,108 @@
+# tiles.py - piramida kafli (w stylu DZI) do powiększania zdjęć w pełnej rozdzielczości
+import hashlib
+import io
+import math
+import os
+import threading
+
+from PIL import Image
+
+from thumbs import DiskLRUCache, FORMATS
+
+TILE_SIZE = 256
+
+
+def max_level(width, height):
+    """Poziom pełnej rozdzielczości; poziom 0 to obraz 1x1 px, każdy kolejny 2x większy."""
+    return max(math.ceil(math.log2(max(width, height, 1))), 0)
+
+
+def level_size(width, height, level, top):
+    scale = 2 ** (top - level)
+    return max(math.ceil(width / scale), 1), max(math.ceil(height / scale), 1)
+
+
+class TileCache:
+    """Kafle JPEG budowane leniwie po jednym poziomie piramidy i trzymane w DiskLRUCache.
+
+    Pierwsze żądanie kafla z danego poziomu dekoduje źródło raz (niższe poziomy
+    w trybie draft JPEG, bez pełnego dekodowania), skaluje je i zapisuje wszystkie
+    kafle poziomu. Równoległe żądania tego samego poziomu czekają na jedno budowanie.
+    """
+
+    def __init__(self, directory, max_bytes, tile_size=TILE_SIZE, max_builds=2):
+        self.cache = DiskLRUCache(directory, max_bytes)
+        self.tile_size = tile_size
+        self._builds = threading.Semaphore(max_builds)  # pełne dekodowanie 20 MP to ~60 MB RAM
+        self._lock = threading.Lock()
+        self._building = {}  # (prefiks, poziom) -> Lock
+
+    def info(self, src):
+        """Wymiary i liczba poziomów piramidy (bez dekodowania pikseli)."""
+        with Image.open(src) as img:
+            width, height = img.size
+        return {
+            "width": width,
+            "height": height,
+            "tile_size": self.tile_size,
+            "max_level": max_level(width, height),
+            "format": "jpg",
+        }
+
+    def _prefix(self, src, st):
+        ident = f"{src}|{st.st_mtime_ns}|{st.st_size}|{self.tile_size}".encode()
+        return hashlib.sha1(ident).hexdigest()
+
+    def get(self, src, level, x, y):
+        """Ścieżka kafla; ValueError dla współrzędnych spoza piramidy."""
+        st = os.stat(src)
+        prefix = self._prefix(src, st)
+        name = f"{prefix}-{level}-{x}_{y}.jpg"
+        path = self.cache.get(name)
+        if path is not None:
+            return path
+        self._check(src, level, x, y)  # bez budowania całego poziomu dla błędnych współrzędnych
+        with self._lock:
+            lock = self._building.setdefault((prefix, level), threading.Lock())
+        try:
+            with lock:
+                path = self.cache.get(name)
+                if path is None:
+                    with self._builds:
+                        tiles = self._build_level(src, level)
+                    for (tx, ty), data in tiles.items():
+                        stored = self.cache.put(f"{prefix}-{level}-{tx}_{ty}.jpg", data)
+                        if (tx, ty) == (x, y):
+                            path = stored
+        finally:
+            with self._lock:
+                self._building.pop((prefix, level), None)
+        return path
+
+    def _check(self, src, level, x, y):
+        info = self.info(src)
+        top = info["max_level"]
+        if not 0 <= level <= top:
+            raise ValueError(f"Poziom {level} poza zakresem 0..{top}")
+        width, height = level_size(info["width"], info["height"], level, top)
+        if not (0 <= x < math.ceil(width / self.tile_size) and 0 <= y < math.ceil(height / self.tile_size)):
+            raise ValueError(f"Brak kafla {level}/{x}_{y}")
+
+    def _build_level(self, src, level):
+        size = self.tile_size
+        _ext, _mimetype, params = FORMATS["jpeg"]
+        with Image.open(src) as img:
+            top = max_level(*img.size)
+            width, height = level_size(*img.size, level, top)
+            img.draft("RGB", (width, height))
+            img = img.convert("RGB")
+            if img.size != (width, height):
+                img = img.resize((width, height), Image.Resampling.LANCZOS)
+        tiles = {}
+        for ty in range(math.ceil(height / size)):
+            for tx in range(math.ceil(width / size)):
+                tile = img.crop((tx * size, ty * size, min((tx + 1) * size, width), min((ty + 1) * size, height)))
+                out = io.BytesIO()
+                tile.save(out, "JPEG", **params)
+                tiles[(tx, ty)] = out.getvalue()
+        return tiles
@@ -0,0 +1,277 @@
+# watcher.py - obserwacja katalogów kamer i zasilanie indeksu nowymi plikami
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+
+from image_index import is_image_name
+
+log = logging.getLogger(__name__)
+
+# Stałe z <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+BASE_MASK = IN_CREATE | IN_MOVED_TO | IN_DELETE | IN_MOVED_FROM | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+CATEGORY_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_DELETE | IN_MOVED_FROM | IN_DELETE_SELF | IN_ONLYDIR
+
+_EVENT = struct.Struct("iIII")  # wd, mask, cookie, len
+_libc = None
+
+
+def _load_libc():
+    global _libc
+    if _libc is None and sys.platform.startswith("linux"):
+        lib = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        lib.inotify_init1.argtypes = [ctypes.c_int]
+        lib.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        lib.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        _libc = lib
+    return _libc
+
+
+def inotify_available():
+    try:
+        return _load_libc() is not None
+    except OSError:
+        return False
+
+
+class PollingWatcher(threading.Thread):
+    """Fallback: co `interval` sekund przeskanowuje tylko zmienione katalogi."""
+
+    def __init__(self, index, interval=1.0):
+        super().__init__(name=f"poll-{index.camera}", daemon=True)
+        self.index = index
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        self.index.watched = True
+        while not self._stop_event.is_set():
+            try:
+                self.index.refresh()
+            except OSError:
+                log.exception("Błąd skanowania kamery %s", self.index.camera)
+            self._stop_event.wait(self.interval)
+        self.index.watched = False
+
+    def stop(self):
+        self._stop_event.set()
+
+
+class InotifyWatcher(threading.Thread):
+    """Nasłuchuje IN_CLOSE_WRITE/IN_MOVED_TO w katalogach kategorii jednej kamery.
+
+    Nowe podkatalogi kategorii są dodawane automatycznie, a przepełnienie
+    kolejki zdarzeń (IN_Q_OVERFLOW) kończy się skanem tylko zmienionych katalogów.
+    Nieoczekiwany błąd (np. EACCES/ENOSPC przy zakładaniu watcha) przełącza
+    kamerę na PollingWatcher zamiast zostawić indeks bez aktualizacji.
+    """
+
+    def __init__(self, index, retry_interval=5.0, on_arrival=None, poll_interval=1.0):
+        super().__init__(name=f"inotify-{index.camera}", daemon=True)
+        self.index = index
+        # on_arrival(index, kategoria, nazwa, mtime, rozmiar) może opóźnić publikację pliku w indeksie
+        self.on_arrival = on_arrival
+        self.retry_interval = retry_interval
+        self.poll_interval = poll_interval
+        self._libc = _load_libc()
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self._wds = {}  # wd -> kategoria ("" = katalog bazowy kamery)
+        self._stop_r, self._stop_w = os.pipe()
+        self._state_lock = threading.Lock()
+        self._stopped = False
+        self._closed = False
+        self._fallback = None  # PollingWatcher po awarii
+
+    # --- obsługa watchy ---
+
+    def _add_watch(self, path, mask):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), mask)
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), str(path))
+        return wd
+
+    def _watch_base(self):
+        try:
+            wd = self._add_watch(self.index.base_dir, BASE_MASK)
+        except OSError as e:
+            if e.errno in (errno.ENOENT, errno.ENOTDIR, errno.EACCES):
+                return False
+            raise
+        self._wds[wd] = ""
+        for entry in os.scandir(self.index.base_dir):
+            if entry.is_dir():
+                self._watch_category(entry.name)
+        # Watche są już założone, więc pełny skan nie zgubi plików wgranych w międzyczasie
+        self.index.refresh()
+        return True
+
+    def _watch_category(self, category):
+        try:
+            wd = self._add_watch(self.index.base_dir / category, CATEGORY_MASK)
+        except OSError as e:
+            if e.errno in (errno.ENOENT, errno.ENOTDIR):
+                return
+            raise
+        self._wds[wd] = category
+
+    def _unwatch_category(self, category):
+        # Przeniesiony katalog zachowuje watch - bez tego zdarzenia trafiłyby do starej kategorii
+        for wd, cat in list(self._wds.items()):
+            if cat == category:
+                self._libc.inotify_rm_watch(self._fd, wd)
+                del self._wds[wd]
+
+    def _rescan_category(self, category):
+        try:
+            self.index.rescan_category(category)
+        except (FileNotFoundError, NotADirectoryError):
+            self.index.drop_category(category)
+
+    # --- pętla zdarzeń ---
+
+    def run(self):
+        failed = False
+        try:
+            self._loop()
+        except Exception:
+            log.exception("Obserwator inotify kamery %s przerwany - przełączam na polling", self.index.camera)
+            failed = True
+        finally:
+            # Indeks oznaczony jako obserwowany nie jest odświeżany przy żądaniach
+            self.index.watched = False
+            with self._state_lock:
+                self._closed = True
+                for fd in (self._fd, self._stop_r, self._stop_w):
+                    os.close(fd)
+        if failed:
+            with self._state_lock:
+                if not self._stopped:
+                    self._fallback = PollingWatcher(self.index, self.poll_interval)
+                    self._fallback.start()
+
+    def _loop(self):
+        watching = False
+        while True:
+            if not watching:
+                watching = self._watch_base()
+                self.index.watched = watching
+                if not watching:
+                    self.index.refresh()  # katalog kamery nie istnieje - czyści indeks
+            timeout = None if watching else self.retry_interval
+            ready, _, _ = select.select([self._fd, self._stop_r], [], [], timeout)
+            if self._stop_r in ready:
+                break
+            if self._fd in ready:
+                watching = self._drain() and watching
+
+    def _drain(self):
+        try:
+            buf = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return True
+        alive = True
+        offset = 0
+        while offset < len(buf):
+            wd, mask, _cookie, length = _EVENT.unpack_from(buf, offset)
+            offset += _EVENT.size
+            name = buf[offset:offset + length].rstrip(b"\0")
+            offset += length
+            alive = self._handle(wd, mask, os.fsdecode(name)) and alive
+        return alive
+
+    def _handle(self, wd, mask, name):
+        if mask & IN_Q_OVERFLOW:
+            log.warning("Przepełnienie kolejki inotify dla kamery %s - skan zmienionych katalogów",
+                        self.index.camera)
+            self.index.refresh()
+            return True
+
+        category = self._wds.get(wd)
+        if category is None:
+            return True
+
+        if mask & IN_IGNORED:
+            self._wds.pop(wd, None)
+            return category != ""
+        if category == "":
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                # Katalog kamery zniknął - wracamy do oczekiwania na jego pojawienie się
+                for wd_ in list(self._wds):
+                    self._libc.inotify_rm_watch(self._fd, wd_)
+                self._wds.clear()
+                return False
+            if mask & IN_ISDIR:
+                if mask & (IN_CREATE | IN_MOVED_TO):
+                    self._watch_category(name)
+                    self._rescan_category(name)
+                elif mask & (IN_DELETE | IN_MOVED_FROM):
+                    self._unwatch_category(name)
+                    self.index.drop_category(name)
+            return True
+
+        if mask & IN_DELETE_SELF:
+            self.index.drop_category(category)
+            return True
+        if mask & IN_ISDIR or not is_image_name(name):
+            return True
+        if mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+            try:
+                st = os.stat(self.index.base_dir / category / name)
+            except FileNotFoundError:
+                return True
+            if self.on_arrival is not None:
+                self.on_arrival(self.index, category, name, st.st_mtime, st.st_size)
+            else:
+                self.index.add(category, name, st.st_mtime, st.st_size)
+        elif mask & (IN_DELETE | IN_MOVED_FROM):
+            self.index.remove(category, name)
+        return True
+
+    def stop(self):
+        with self._state_lock:
+            self._stopped = True
+            if self._fallback is not None:
+                self._fallback.stop()
+            elif not self._closed:
+                os.write(self._stop_w, b"x")
+
+
+def start_watcher(index, mode="auto", poll_interval=1.0, on_arrival=None):
+    """Uruchamia obserwatora indeksu: inotify na Linuksie, w innym razie polling."""
+    if mode in ("auto", "inotify") and inotify_available():
+        try:
+            watcher = InotifyWatcher(index, on_arrival=on_arrival, poll_interval=poll_interval)
+        except OSError:
+            if mode == "inotify":
+                raise
+            log.exception("inotify niedostępne dla kamery %s - przełączam na polling", index.camera)
+            watcher = PollingWatcher(index, poll_interval)
+    elif mode == "inotify":
+        raise RuntimeError("inotify niedostępne na tej platformie")
+    else:
+        watcher = PollingWatcher(index, poll_interval)
+    watcher.start()
+    return watcher
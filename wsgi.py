@@ -0,0 +1,56 @@
+# wsgi.py - punkt wejścia serwera produkcyjnego: gunicorn -c gunicorn.conf.py wsgi:app
+#
+# Obserwatory katalogów, pula miniatur i zapis katalogu historii działają tylko
+# w jednym procesie ("właściciel", wybierany blokadą pliku). Pozostałe procesy
+# serwują z własnych indeksów odświeżanych przy żądaniach (skan tylko zmienionych
+# katalogów, współdzielony przez SCAN_FRESHNESS) i czytają wspólną bazę SQLite.
+# Gdy właściciel zginie, jego rolę przejmuje kolejny proces.
+import fcntl
+import logging
+import os
+import threading
+
+from app import app, start_background, install_reload_signal, DATA_DIR
+
+log = logging.getLogger(__name__)
+
+OWNER_LOCK = DATA_DIR / "owner.lock"
+OWNER_RETRY = 5.0
+
+_lock_file = None
+
+
+def _try_become_owner():
+    global _lock_file
+    DATA_DIR.mkdir(parents=True, exist_ok=True)
+    f = open(OWNER_LOCK, "a+")
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        f.close()
+        return False
+    _lock_file = f  # blokada trwa tak długo, jak długo plik jest otwarty
+    return True
+
+
+def _wait_for_ownership(stop):
+    while not stop.wait(OWNER_RETRY):
+        if _try_become_owner():
+            log.info("Proces %d przejmuje obserwację katalogów", os.getpid())
+            start_background(owner=True)
+            return
+
+
+def init_worker():
+    """Wywoływane raz w każdym procesie serwera, po forku."""
+    install_reload_signal()
+    if _try_become_owner():
+        log.info("Proces %d obserwuje katalogi kamer", os.getpid())
+        start_background(owner=True)
+    else:
+        start_background(owner=False)
+        threading.Thread(target=_wait_for_ownership, args=(threading.Event(),),
+                         name="owner-election", daemon=True).start()
+
+
+__all__ = ["app", "init_worker"]